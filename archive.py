@@ -0,0 +1,110 @@
+"""Archive — moves old expired subscriptions and settled payments out of the hot tables.
+
+The scheduler, the admin payment list and the statistics all work on the
+`subscription` and `payment` tables, so these are kept to the active
+population: once ARCHIVE_AFTER_DAYS have passed, inactive subscriptions
+(by end date) and approved / rejected payments (by creation date) are moved
+to `subscription_archive` / `payment_archive`, keeping their ids. A payment
+stays while a hot subscription still refers to it. The row with the highest
+id always stays: without AUTOINCREMENT SQLite would hand its id to the next
+row, clashing with the archived copy and its outbox idempotency keys. Rows are moved in batches
+of ARCHIVE_BATCH_SIZE, one short write transaction each.
+
+The admin payment detail view falls back to the archive
+(`queries.get_archived_payment`); totals in the statistics include it.
+"""
+
+import datetime
+import logging
+
+from peewee import fn
+
+import metrics
+import stats
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from database import (
+    db_task, write_transaction, Payment, Subscription, AdminMessage, ArchivedPayment, ArchivedSubscription,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@db_task
+def archive_subscriptions(cutoff: datetime.datetime, limit: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to `limit` inactive subscriptions that ended before `cutoff`; returns rows moved."""
+    now = datetime.datetime.now()
+    with write_transaction():
+        rows = list(
+            Subscription.select()
+            .where(
+                (Subscription.is_active == False)
+                & (Subscription.end_date < cutoff)
+                & (Subscription.id < Subscription.select(fn.MAX(Subscription.id)))
+            )
+            .order_by(Subscription.id)
+            .limit(limit)
+            .dicts()
+        )
+        if not rows:
+            return 0
+        for row in rows:
+            row["payment_id"] = row.pop("payment")
+            del row["is_active"]
+            row["archived_at"] = now
+        ArchivedSubscription.insert_many(rows).execute()
+        Subscription.delete().where(Subscription.id.in_([row["id"] for row in rows])).execute()
+    return len(rows)
+
+
+@db_task
+def archive_payments(cutoff: datetime.datetime, limit: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to `limit` decided payments created before `cutoff`; returns rows moved."""
+    now = datetime.datetime.now()
+    referenced = Subscription.select().where(Subscription.payment == Payment.id)
+    with write_transaction():
+        rows = list(
+            Payment.select()
+            .where(
+                Payment.status.in_(list(stats.ARCHIVED_COUNTERS))
+                & (Payment.created_at < cutoff)
+                & ~fn.EXISTS(referenced)
+                & (Payment.id < Payment.select(fn.MAX(Payment.id)))
+            )
+            .order_by(Payment.id)
+            .limit(limit)
+            .dicts()
+        )
+        if not rows:
+            return 0
+        moved = {}
+        for row in rows:
+            row["archived_at"] = now
+            moved[row["status"]] = moved.get(row["status"], 0) + 1
+        ids = [row["id"] for row in rows]
+        ArchivedPayment.insert_many(rows).execute()
+        AdminMessage.delete().where(AdminMessage.payment.in_(ids)).execute()
+        Payment.delete().where(Payment.id.in_(ids)).execute()
+        for status, count in moved.items():
+            stats.bump(stats.PAYMENT_COUNTERS[status], -count)
+            stats.bump(stats.ARCHIVED_COUNTERS[status], count)
+    return len(rows)
+
+
+async def archive_old(days: int = ARCHIVE_AFTER_DAYS) -> tuple:
+    """Archive everything older than `days`; returns (subscriptions, payments) moved."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    # Subscriptions first: they free the payments they refer to
+    subscriptions = 0
+    while moved := await archive_subscriptions(cutoff):
+        subscriptions += moved
+    payments = 0
+    while moved := await archive_payments(cutoff):
+        payments += moved
+    return subscriptions, payments
+
+
+@metrics.timed_job("archive")
+async def archive_job(context):
+    """Move old rows to the archive tables (run daily by the job queue)."""
+    subscriptions, payments = await archive_old()
+    logger.info(f"Archive: {subscriptions} subscriptions and {payments} payments archived")
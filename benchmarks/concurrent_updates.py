@@ -0,0 +1,86 @@
+"""Parallel users vs. sequential processing, against the fake Bot API.
+
+Many users press "Obuna holati" at once while the fake API answers every call
+after `--api-latency` seconds; with one worker each reply waits for all the
+earlier ones. A few users also walk through the registration steps to check
+that their own updates are still handled in order.
+
+    python benchmarks/concurrent_updates.py --users 200 --api-latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bot.db")
+
+from benchmarks.fake_bot_api import FakeBotRequest, text_update  # noqa: E402
+from bot import build_application  # noqa: E402
+from handlers.registration import BTN_JOIN, BTN_STATUS  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+REGISTRATION_STEPS = [BTN_JOIN, "Akmal Akbarov", "+998901234567"]
+
+
+async def run(workers: int, users: int, api_latency: float, ordered_users: int) -> dict:
+    fake = FakeBotRequest(latency=api_latency)
+    app = build_application(request=fake, workers=workers)
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+
+    status_users = [20_000 + i for i in range(users)]
+    flow_users = [30_000 + i for i in range(ordered_users)]
+    replies = [asyncio.ensure_future(fake.wait_for_message(u)) for u in status_users]
+
+    start = time.perf_counter()
+    for user_id in status_users:
+        fake.push_update(text_update(fake.next_update_id(), user_id, BTN_STATUS))
+    for step in REGISTRATION_STEPS:
+        for user_id in flow_users:
+            fake.push_update(text_update(fake.next_update_id(), user_id, step))
+    await asyncio.gather(*replies)
+    elapsed = time.perf_counter() - start
+
+    # Each flow user must get one reply per step, the last one from ask_phone
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and any(
+        len(fake.sent_text[u]) < len(REGISTRATION_STEPS) for u in flow_users
+    ):
+        await asyncio.sleep(0.05)
+    in_order = sum(
+        1 for u in flow_users
+        if len(fake.sent_text[u]) == len(REGISTRATION_STEPS)
+        and "karta" in fake.sent_text[u][-1]
+    )
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    return {"workers": workers, "seconds": elapsed, "in_order": in_order, "flows": ordered_users}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--flows", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    run_migrations()
+    for workers in (1, args.workers):
+        r = await run(workers, args.users, args.api_latency, args.flows)
+        print(
+            f"workers={r['workers']:<3} {args.users} parallel status replies in {r['seconds']:.2f}s, "
+            f"registration flows in order: {r['in_order']}/{r['flows']}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+"""Offline stand-in for the Telegram Bot API.
+
+`FakeBotRequest` plugs into python-telegram-bot as the request backend, so a
+real `Application` runs against it without network access. Every call can be
+delayed (`latency`) and a fraction of them answered with 429 (`flood_rate`).
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeBotRequest(BaseRequest):
+    """Answers Bot API calls locally, recording what was called and when."""
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = defaultdict(int)
+        self.floods = 0
+        # chat_id -> monotonic time and text/caption of every message sent to it
+        self.sent_at = defaultdict(list)
+        self.sent_text = defaultdict(list)
+        # API method -> parameters of its most recent call
+        self.last_params = {}
+        self.updates = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._waiters = defaultdict(list)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    # ── Helpers for benchmarks ──
+
+    def next_update_id(self) -> int:
+        return next(self._update_ids)
+
+    def push_update(self, update: dict):
+        """Queue an update for getUpdates (polling mode)."""
+        self.updates.put_nowait(update)
+
+    async def wait_for_message(self, chat_id: int):
+        """Wait until the bot sends the next message to `chat_id`."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return await future
+
+    # ── BaseRequest ──
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        self.last_params[api_method] = params
+
+        if api_method == "getUpdates":
+            updates = await self._get_updates(params)
+            if updates and self.latency:
+                await asyncio.sleep(self.latency)
+            return 200, self._ok(updates)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            self.floods += 1
+            body = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+            return 429, json.dumps(body).encode()
+
+        return 200, self._ok(self._result(api_method, params))
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01))
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _result(self, api_method, params):
+        now = int(time.time())
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in ("sendMessage", "sendPhoto", "copyMessage"):
+            chat_id = int(params["chat_id"])
+            self.sent_at[chat_id].append(time.monotonic())
+            message = {
+                "message_id": next(self._message_ids),
+                "date": now,
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": BOT_USER,
+            }
+            if api_method == "sendPhoto":
+                message["photo"] = [
+                    {"file_id": f"photo-{message['message_id']}", "file_unique_id": "u", "width": 1, "height": 1}
+                ]
+                message["caption"] = params.get("caption", "")
+            else:
+                message["text"] = params.get("text", "")
+            self.sent_text[chat_id].append(message.get("text") or message.get("caption"))
+            for waiter in self._waiters.pop(chat_id, []):
+                if not waiter.done():
+                    waiter.set_result(message)
+            return message
+        if api_method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            return True
+        if api_method == "createChatInviteLink":
+            return {
+                "invite_link": f"https://t.me/+fake{self.calls[api_method]}",
+                "creator": BOT_USER,
+                "creates_join_request": bool(params.get("creates_join_request")),
+                "is_primary": False,
+                "is_revoked": False,
+                "expire_date": params.get("expire_date"),
+            }
+        if api_method == "getChat":
+            return {"id": int(params["chat_id"]), "type": "supergroup", "title": "Bench group"}
+        if api_method == "getChatMember":
+            return {"status": "left", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "U"}}
+        # setWebhook, deleteWebhook, banChatMember, unbanChatMember, answerCallbackQuery, ...
+        return True
+
+    @staticmethod
+    def _ok(result) -> bytes:
+        return json.dumps({"ok": True, "result": result}).encode()
+
+
+def _private_message(update_id: int, user_id: int, **content) -> dict:
+    return {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": "U"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+        **content,
+    }
+
+
+def text_update(update_id: int, user_id: int, text: str) -> dict:
+    """A private text message update from `user_id`."""
+    return {"update_id": update_id, "message": _private_message(update_id, user_id, text=text)}
+
+
+def photo_update(update_id: int, user_id: int, file_id: str = "receipt") -> dict:
+    """A private photo message update from `user_id`."""
+    photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+    return {"update_id": update_id, "message": _private_message(update_id, user_id, photo=photo)}
+
+
+def join_request_update(update_id: int, user_id: int, chat_id: int) -> dict:
+    """A request from `user_id` to join the group `chat_id`."""
+    return {
+        "update_id": update_id,
+        "chat_join_request": {
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Bench group"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "user_chat_id": user_id,
+            "date": int(time.time()),
+        },
+    }
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """A press of an inline button with `data` on a text message sent to `user_id`."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "U"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
@@ -0,0 +1,132 @@
+"""Mixed read/write throughput: configured storage profile vs SQLite defaults.
+
+Readers repeat the join-request lookup (user's active subscription) while
+writers flip subscription flags in small transactions, like the scheduler.
+
+    python benchmarks/sqlite_profile.py --users 20000 --seconds 10
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import OperationalError  # noqa: E402
+from playhouse.pool import PooledDatabase  # noqa: E402
+
+from database import db, storage_options, write_transaction, User, Payment, Subscription  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+import queries  # noqa: E402
+
+
+def seed(users: int):
+    now = datetime.datetime.now()
+    with db.atomic():
+        for start in range(0, users, 500):
+            batch = range(start, min(start + 500, users))
+            User.insert_many(
+                [{"telegram_id": 10_000 + i, "first_name": "U", "last_name": str(i), "phone": "0"} for i in batch]
+            ).execute()
+            Payment.insert_many(
+                [{"user": i + 1, "amount": 1, "receipt_file_id": "x", "status": "approved"} for i in batch]
+            ).execute()
+            Subscription.insert_many(
+                [
+                    {"user": i + 1, "payment": i + 1, "end_date": now + datetime.timedelta(days=i % 40 - 5)}
+                    for i in batch
+                ]
+            ).execute()
+
+
+def run(label: str, options: dict, users: int, seconds: float, readers: int, writers: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bot.db")
+    if isinstance(db, PooledDatabase):
+        # Otherwise the previous profile's pooled connections are reused
+        db.close_all()
+        # Pooled connections move between threads
+        options = {**options, "check_same_thread": False}
+    db.init(path, **options)
+    run_migrations()
+    with db.connection_context():
+        seed(users)
+        journal_mode = db.execute_sql("PRAGMA journal_mode").fetchone()[0]
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def reader():
+        rng = random.Random()
+        n = 0
+        with db.connection_context():
+            while time.monotonic() < deadline:
+                try:
+                    queries.get_subscription_status.sync(10_000 + rng.randrange(users))
+                    n += 1
+                except OperationalError:
+                    with lock:
+                        counts["errors"] += 1
+        with lock:
+            counts["reads"] += n
+
+    def writer():
+        rng = random.Random()
+        n = 0
+        with db.connection_context():
+            while time.monotonic() < deadline:
+                ids = [rng.randrange(1, users + 1) for _ in range(500)]
+                try:
+                    with write_transaction():
+                        Subscription.update(warning_sent=rng.random() < 0.5).where(Subscription.id.in_(ids)).execute()
+                    n += 1
+                except OperationalError:
+                    with lock:
+                        counts["errors"] += 1
+        with lock:
+            counts["writes"] += n
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db.close()
+
+    return {
+        "profile": label,
+        "journal_mode": journal_mode,
+        "reads_per_s": counts["reads"] / seconds,
+        "write_txn_per_s": counts["writes"] / seconds,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=1)
+    args = parser.parse_args()
+
+    results = [
+        # Explicit, or db.init() keeps the pragmas the shared db was built with
+        run("defaults", {"pragmas": {}, "timeout": 5}, args.users, args.seconds, args.readers, args.writers),
+        run("profile", storage_options(), args.users, args.seconds, args.readers, args.writers),
+    ]
+    for r in results:
+        print(
+            f"{r['profile']:<10} journal={r['journal_mode']:<8} reads/s={r['reads_per_s']:>9.0f}  "
+            f"write txn/s={r['write_txn_per_s']:>7.0f}  errors={r['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
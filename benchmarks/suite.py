@@ -0,0 +1,351 @@
+"""Offline benchmark suite: synthetic populations against the fake Bot API.
+
+For every population size a fresh bot.db is seeded (users, payments, current
+and past subscriptions) and the bot runs against `FakeBotRequest`, which can
+add latency and answer a fraction of calls with 429. Measured:
+
+  * expiry timer rebuild and `check_subscriptions` wall time, then how fast
+    the outbox drains the queued warnings and kicks;
+  * join-request latency (p50/p99), with a cold and a warm status cache;
+  * admin payments page render latency while paging through the list;
+  * registration throughput (menu → name → phone → receipt) for many users.
+
+Each population runs in its own process, so caches and database connections
+never leak between sizes. Results are written as JSON for tracking regressions:
+
+    python benchmarks/suite.py --users 10000,100000,1000000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_ID = 777
+CHANNEL_IDS = (-1001, -1002)
+FIRST_TELEGRAM_ID = 100_000
+SEED_CHUNK = 10_000
+IDLE_TIMEOUT = 5
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+# ─── Child: one population ──────────────────────────────────────
+
+def seed(users: int):
+    """Insert `users` users, each with an approved payment and a subscription.
+
+    Subscription ends are spread evenly from one day ago to 59 days ahead, so
+    a daily check sees about 1/60 expired and 3/60 to warn. Every second user
+    also has an old expired subscription, and every 50th a pending payment.
+    """
+    from database import db, User, Payment, Subscription, Card, Channel
+    import stats
+
+    now = datetime.datetime.now()
+    span = 60 * 24 * 60  # minutes
+    with db.connection_context():
+        for start in range(0, users, SEED_CHUNK):
+            ids = range(start + 1, min(start + SEED_CHUNK, users) + 1)
+            with db.atomic():
+                User.insert_many(
+                    {"id": i, "telegram_id": FIRST_TELEGRAM_ID + i, "first_name": "U", "last_name": str(i), "phone": "0"}
+                    for i in ids
+                ).execute()
+                Payment.insert_many(
+                    {
+                        "id": i,
+                        "user": i,
+                        "amount": 99000,
+                        "receipt_file_id": "seed",
+                        "status": "approved",
+                        "created_at": now - datetime.timedelta(minutes=(i * 7919) % span),
+                    }
+                    for i in ids
+                ).execute()
+                subs = []
+                for i in ids:
+                    end = now + datetime.timedelta(minutes=(i * 7919) % span - 24 * 60)
+                    subs.append({"user": i, "payment": i, "start_date": end - datetime.timedelta(days=30), "end_date": end})
+                    if i % 2 == 0:
+                        old_end = now - datetime.timedelta(days=40)
+                        subs.append({
+                            "user": i, "payment": i, "is_active": False, "warning_sent": True,
+                            "start_date": old_end - datetime.timedelta(days=30), "end_date": old_end,
+                        })
+                Subscription.insert_many(subs).execute()
+        with db.atomic():
+            Payment.insert_many(
+                {"user": i, "amount": 99000, "receipt_file_id": "seed", "status": "pending"}
+                for i in range(50, users + 1, 50)
+            ).execute()
+            Card.create(card_number="8600 0000 0000 0001", card_holder="Bench")
+            for chat_id in CHANNEL_IDS:
+                Channel.create(chat_id=chat_id, title=f"Group {chat_id}")
+            stats.reconcile()
+
+
+async def measure_expiry(app, results: dict, drain_seconds: float):
+    from database import run_db, Outbox
+    from dispatcher import outbox_dispatcher
+    from scheduler import check_subscriptions, expiry_timers
+
+    start = time.perf_counter()
+    loaded = await expiry_timers.rebuild()
+    results["timer_rebuild_s"] = time.perf_counter() - start
+    results["timers"] = loaded
+
+    class Context:
+        bot = app.bot
+
+    start = time.perf_counter()
+    await check_subscriptions(Context())
+    results["check_subscriptions_s"] = time.perf_counter() - start
+
+    def pending():
+        return Outbox.select().where(Outbox.status == "pending").count()
+
+    queued = await run_db(pending)
+    results["outbox_queued"] = queued
+
+    start = time.perf_counter()
+    await outbox_dispatcher.start(app.bot)
+    left = queued
+    while left and time.perf_counter() - start < drain_seconds:
+        await asyncio.sleep(0.2)
+        left = await run_db(pending)
+    elapsed = time.perf_counter() - start
+    await outbox_dispatcher.stop()
+    results["outbox_drain"] = {
+        "seconds": elapsed,
+        "done": queued - left,
+        "left": left,
+        "actions_per_s": (queued - left) / elapsed if elapsed else 0.0,
+    }
+
+
+async def measure_joins(app, fake, users: int, joins: int, results: dict):
+    from telegram import Update
+    from benchmarks.fake_bot_api import join_request_update
+    from cache import subscription_cache, warm_subscription_cache
+
+    rng = random.Random(1)
+    # One in ten requests comes from someone who never registered
+    ids = [
+        FIRST_TELEGRAM_ID + rng.randint(1, users) if rng.random() < 0.9 else 10 * FIRST_TELEGRAM_ID * 1000 + n
+        for n in range(joins)
+    ]
+
+    async def run(label):
+        latencies = []
+        for user_id in ids:
+            update = Update.de_json(join_request_update(fake.next_update_id(), user_id, CHANNEL_IDS[0]), app.bot)
+            start = time.perf_counter()
+            await app.process_update(update)
+            latencies.append(time.perf_counter() - start)
+        results[label] = percentiles(latencies)
+
+    subscription_cache.clear()
+    await run("join_cold")
+    subscription_cache.clear()
+    await warm_subscription_cache()
+    await run("join_warm")
+
+
+def _next_page_data(fake):
+    markup = fake.last_params.get("editMessageText", {}).get("reply_markup")
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    for row in (markup or {}).get("inline_keyboard", []):
+        for button in row:
+            if button["text"].startswith("Keyingi"):
+                return button["callback_data"]
+    return None
+
+
+async def measure_admin(app, fake, pages: int, results: dict):
+    from telegram import Update
+    from benchmarks.fake_bot_api import callback_update
+
+    async def press(data):
+        update = Update.de_json(callback_update(fake.next_update_id(), ADMIN_ID, data), app.bot)
+        start = time.perf_counter()
+        await app.process_update(update)
+        return time.perf_counter() - start
+
+    results["admin_stats"] = percentiles([await press("admin_stats") for _ in range(pages)])
+
+    for label, first in (("admin_payments", "admin_payments"), ("admin_payments_pending", "admin_payments_f_p")):
+        latencies = []
+        data = first
+        for _ in range(pages):
+            latencies.append(await press(data))
+            data = _next_page_data(fake)
+            if data is None:
+                break
+        results[label] = percentiles(latencies)
+
+
+async def measure_registrations(app, fake, registrations: int, results: dict):
+    from benchmarks.fake_bot_api import photo_update, text_update
+    from handlers.registration import BTN_JOIN
+
+    users = [900_000_000 + i for i in range(registrations)]
+    steps = [BTN_JOIN, "Akmal Akbarov", "+998901234567", None]
+
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+    start = time.perf_counter()
+    for step in steps:
+        for user_id in users:
+            if step is None:
+                fake.push_update(photo_update(fake.next_update_id(), user_id))
+            else:
+                fake.push_update(text_update(fake.next_update_id(), user_id, step))
+
+    # Handler replies are not retried, so with 429 injection some flows never
+    # finish; stop once nothing has moved for IDLE_TIMEOUT seconds
+    progress, last_change = -1, time.perf_counter()
+    while any(len(fake.sent_text[u]) < len(steps) for u in users):
+        sent = sum(len(fake.sent_text[u]) for u in users)
+        if sent != progress:
+            progress, last_change = sent, time.perf_counter()
+        elif time.perf_counter() - last_change > IDLE_TIMEOUT:
+            break
+        await asyncio.sleep(0.05)
+    else:
+        last_change = time.perf_counter()
+    elapsed = last_change - start
+    completed = sum(1 for u in users if len(fake.sent_text[u]) >= len(steps))
+    await app.updater.stop()
+    await app.stop()
+
+    results["registrations"] = {
+        "users": registrations,
+        "completed": completed,
+        "seconds": elapsed,
+        "per_s": completed / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_population(args) -> dict:
+    from benchmarks.fake_bot_api import FakeBotRequest
+    from bot import build_application
+    from migrations import run_migrations
+
+    results = {"users": args.child}
+    run_migrations()
+    start = time.perf_counter()
+    seed(args.child)
+    results["seed_s"] = time.perf_counter() - start
+
+    fake = FakeBotRequest(latency=args.api_latency, flood_rate=args.flood_rate, retry_after=1)
+    app = build_application(request=fake)
+    await app.initialize()
+
+    await measure_expiry(app, results, args.drain_seconds)
+    await measure_joins(app, fake, args.child, args.joins, results)
+    await measure_admin(app, fake, args.pages, results)
+    await measure_registrations(app, fake, args.registrations, results)
+
+    await app.shutdown()
+    results["api_calls"] = dict(fake.calls)
+    results["api_floods"] = fake.floods
+    return results
+
+
+# ─── Parent: every population, one process each ────────────────
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+
+def run_all(args) -> dict:
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "api_latency": args.api_latency,
+            "flood_rate": args.flood_rate,
+            "joins": args.joins,
+            "pages": args.pages,
+            "registrations": args.registrations,
+            "drain_seconds": args.drain_seconds,
+        },
+        "populations": [],
+    }
+    for users in [int(n) for n in args.users.split(",")]:
+        env = dict(os.environ)
+        env["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bot.db")
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--child", str(users),
+            "--api-latency", str(args.api_latency), "--flood-rate", str(args.flood_rate),
+            "--joins", str(args.joins), "--pages", str(args.pages),
+            "--registrations", str(args.registrations), "--drain-seconds", str(args.drain_seconds),
+        ]
+        print(f"→ {users} users ...", file=sys.stderr)
+        out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        report["populations"].append(result)
+        print(
+            f"  seed {result['seed_s']:.1f}s | check_subscriptions {result['check_subscriptions_s']:.2f}s "
+            f"({result['outbox_queued']} queued, drained {result['outbox_drain']['actions_per_s']:.1f}/s) | "
+            f"join p50/p99 {result['join_warm']['p50_ms']:.2f}/{result['join_warm']['p99_ms']:.2f} ms | "
+            f"admin page p50 {result['admin_payments']['p50_ms']:.2f} ms | "
+            f"registrations {result['registrations']['per_s']:.1f}/s",
+            file=sys.stderr,
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="10000,100000", help="comma-separated population sizes")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency (s)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--joins", type=int, default=1000, help="join requests per cache pass")
+    parser.add_argument("--pages", type=int, default=20, help="admin pages to walk")
+    parser.add_argument("--registrations", type=int, default=200)
+    parser.add_argument("--drain-seconds", type=float, default=10.0, help="cap on the outbox drain phase")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        os.environ.setdefault("BOT_TOKEN", "123456:bench")
+        os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+        logging.disable(logging.WARNING)
+        print(json.dumps(asyncio.run(run_population(args))))
+        return
+
+    report = run_all(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
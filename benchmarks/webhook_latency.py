@@ -0,0 +1,110 @@
+"""End-to-end update latency: webhook vs polling, against the fake Bot API.
+
+Each synthetic update is a press of the "Obuna holati" button; latency is the
+time from handing the update to the bot (HTTP POST to the webhook, or queueing
+it for getUpdates) until the bot's reply reaches the fake API.
+
+    python benchmarks/webhook_latency.py --updates 200 --api-latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bot.db")
+
+import httpx  # noqa: E402
+
+from benchmarks.fake_bot_api import FakeBotRequest, text_update  # noqa: E402
+from bot import build_application  # noqa: E402
+from database import db, User  # noqa: E402
+from handlers.registration import BTN_STATUS  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+WEBHOOK_PORT = 18443
+SECRET = "bench-secret"
+
+
+def seed(users: int):
+    with db.connection_context(), db.atomic():
+        User.insert_many(
+            [{"telegram_id": 10_000 + i, "first_name": "U", "last_name": str(i), "phone": "0"} for i in range(users)]
+        ).execute()
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+async def measure(mode: str, updates: int, users: int, api_latency: float) -> dict:
+    fake = FakeBotRequest(latency=api_latency)
+    app = build_application(request=fake)
+    await app.initialize()
+    await app.start()
+
+    client = httpx.AsyncClient()
+    if mode == "webhook":
+        await app.updater.start_webhook(
+            listen="127.0.0.1",
+            port=WEBHOOK_PORT,
+            url_path="tg",
+            secret_token=SECRET,
+            webhook_url="https://example.invalid/tg",
+        )
+
+        async def deliver(update):
+            await client.post(
+                f"http://127.0.0.1:{WEBHOOK_PORT}/tg",
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+            )
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+
+        async def deliver(update):
+            fake.push_update(update)
+
+    latencies = []
+    for i in range(updates):
+        user_id = 10_000 + i % users
+        reply = asyncio.ensure_future(fake.wait_for_message(user_id))
+        start = time.perf_counter()
+        await deliver(text_update(fake.next_update_id(), user_id, BTN_STATUS))
+        await reply
+        latencies.append(time.perf_counter() - start)
+
+    await client.aclose()
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    return {"mode": mode, "updates": updates, **percentiles(latencies)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated one-way Bot API latency (s)")
+    args = parser.parse_args()
+
+    run_migrations()
+    seed(args.users)
+
+    for mode in ("polling", "webhook"):
+        r = await measure(mode, args.updates, args.users, args.api_latency)
+        print(f"{r['mode']:<8} n={r['updates']}  p50={r['p50_ms']:.2f} ms  p99={r['p99_ms']:.2f} ms  max={r['max_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,14 +7,37 @@ import html
 
 from telegram import Update
 from telegram.ext import Application, ContextTypes
-
-from config import BOT_TOKEN
-from database import create_tables
+from telegram.request import HTTPXRequest
+
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    UPDATE_WORKERS,
+    UPDATE_MAX_PENDING,
+    METRICS_LISTEN,
+    METRICS_PORT,
+)
+from migrations import run_migrations
 from handlers.registration import get_registration_handler
 from handlers.payment import get_payment_handler
 from handlers.admin import get_admin_handlers
-from handlers.membership import get_membership_handler
-from scheduler import check_subscriptions
+from handlers.membership import get_membership_handlers
+from scheduler import check_subscriptions, expiry_timers
+from dispatcher import outbox_dispatcher, purge_job
+from archive import archive_job
+from stats import reconcile_job
+from channel_members import reconcile_job as members_reconcile_job
+from cache import config_cache, warm_subscription_cache
+from update_processor import PerUserUpdateProcessor
+from metrics import InstrumentedRequest, MetricsServer
+from persistence import SQLitePersistence
+from leader import leader_only, scheduler_lease
 
 # ── Logging ───────────────────────────────────────────────────────
 logging.basicConfig(
@@ -23,15 +46,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-
-def main():
-    """Start the bot."""
-    # Create database tables
-    create_tables()
-    logger.info("Database tables created.")
-
-    # Build application
-    app = Application.builder().token(BOT_TOKEN).build()
+metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+
+
+def build_application(request=None, workers: int = UPDATE_WORKERS) -> Application:
+    """Build the application with all handlers registered.
+
+    `request` replaces the Bot API transport (used by the offline benchmarks).
+    Either way every Bot API call is timed for the metrics endpoint. Up to
+    `workers` updates are processed concurrently; updates from the same user
+    stay in order.
+    """
+    if request is None:
+        # Same pool sizes PTB would pick for its own defaults
+        bot_request, updates_request = HTTPXRequest(connection_pool_size=256), HTTPXRequest()
+    else:
+        bot_request = updates_request = request
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(workers, UPDATE_MAX_PENDING))
+        .persistence(SQLitePersistence())
+        .request(InstrumentedRequest(bot_request))
+        .get_updates_request(InstrumentedRequest(updates_request))
+    )
+    app = builder.build()
 
     # ── Register handlers ──
     # Registration conversation + standalone menu button handlers
@@ -47,25 +88,101 @@ def main():
     # Payment approval / rejection callbacks
     app.add_handler(get_payment_handler(), group=2)
 
-    # Join request handler
-    app.add_handler(get_membership_handler(), group=3)
+    # Join requests and channel joins / leaves
+    for handler in get_membership_handlers():
+        app.add_handler(handler, group=3)
+
+    # ── Error handler ──
+    app.add_error_handler(error_handler)
+
+    return app
+
 
-    # ── Schedule daily subscription check ──
+def schedule_jobs(app: Application):
+    """Register the periodic jobs; every instance registers them, only the leader runs them."""
     job_queue = app.job_queue
-    # Run every day at 09:00 (UTC+5)
+    # Catch channel joins / leaves the bot missed, just before the daily check
     job_queue.run_daily(
-        check_subscriptions,
-        time=datetime.time(hour=0, minute=0, second=0),  # 05:00 UTC+5 = 00:00 UTC
+        leader_only(members_reconcile_job),
+        time=datetime.time(hour=23, minute=30, second=0),
+        name="members_reconcile",
+    )
+    # Expiry timers handle subscriptions as they come due; this daily run
+    # only catches anything they missed. 05:00 UTC+5 = 00:00 UTC
+    job_queue.run_daily(
+        leader_only(check_subscriptions),
+        time=datetime.time(hour=0, minute=0, second=0),
         name="subscription_check",
     )
-    # Also run once on startup (after 10 seconds)
-    job_queue.run_once(check_subscriptions, when=10, name="startup_check")
+    # Rebuild statistics counters from the source tables once a day
+    job_queue.run_daily(
+        leader_only(reconcile_job),
+        time=datetime.time(hour=0, minute=30, second=0),
+        name="stats_reconcile",
+    )
+    # Drop completed outbox actions after OUTBOX_KEEP_DAYS
+    job_queue.run_daily(
+        leader_only(purge_job),
+        time=datetime.time(hour=1, minute=0, second=0),
+        name="outbox_purge",
+    )
+    # Move old expired subscriptions and settled payments to the archive
+    job_queue.run_daily(
+        leader_only(archive_job),
+        time=datetime.time(hour=1, minute=30, second=0),
+        name="archive",
+    )
 
-    # ── Error handler ──
-    app.add_error_handler(error_handler)
 
-    logger.info("Bot is starting...")
-    app.run_polling(drop_pending_updates=True)
+def main():
+    """Start the bot."""
+    # Create / upgrade database schema
+    run_migrations()
+    logger.info("Database schema is up to date.")
+
+    app = build_application()
+    schedule_jobs(app)
+
+    if BOT_MODE == "webhook":
+        # Telegram keeps undelivered updates queued while we are down,
+        # so they are not dropped on restart.
+        logger.info(f"Bot is starting (webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False,
+            # chat_member updates are only sent when asked for
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.info("Bot is starting (polling)...")
+        app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+
+
+async def on_startup(app: Application):
+    """Warm in-process caches and start background workers before the first update.
+
+    Outbox actions left over from a previous run are resumed. The expiry
+    timers run while this instance holds the scheduler lease; timers that came
+    due while no instance was running fire right away.
+    """
+    await config_cache.warm()
+    loaded = await warm_subscription_cache()
+    logger.info(f"Subscription cache warmed with {loaded} active users.")
+    await outbox_dispatcher.start(app.bot)
+    await scheduler_lease.start(on_elected=expiry_timers.start, on_demoted=expiry_timers.stop)
+    if METRICS_PORT:
+        await metrics_server.start()
+
+
+async def on_shutdown(app: Application):
+    await metrics_server.stop()
+    await scheduler_lease.stop()
+    await outbox_dispatcher.stop()
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
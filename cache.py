@@ -0,0 +1,195 @@
+"""In-process caches for hot read paths.
+
+All caches here are used from the event loop only, so they need no locking.
+"""
+
+import datetime
+import time
+from collections import OrderedDict
+
+import metrics
+import queries
+from config import SUB_CACHE_TTL, SUB_CACHE_NEGATIVE_TTL, SUB_CACHE_MAX_ENTRIES, CONFIG_CACHE_TTL
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU cache with a per-entry time-to-live and a hard entry cap.
+
+    `version` grows on every invalidation: a caller that loads a value
+    reads it before the load and passes it to set(), which then drops the
+    value if the key may have been invalidated while it was loading.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[1] < time.monotonic():
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, version=None, ttl=None):
+        if version is not None and version != self.version:
+            return
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.version += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.version += 1
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# ─── Subscription status ────────────────────────────────────────
+# telegram_id -> end date of the active subscription, None when the user has
+# no active subscription, or UNREGISTERED when there is no such user.
+# Approvals and registrations invalidate only this instance's cache, so
+# negative values are kept for SUB_CACHE_NEGATIVE_TTL: other instances
+# sharing the database then stop declining the user soon after.
+
+subscription_cache = TTLCache(SUB_CACHE_MAX_ENTRIES, SUB_CACHE_TTL)
+
+# Exported on /metrics by name
+CACHES = {"subscription": subscription_cache}
+
+
+def _cache_stat(key: str):
+    return lambda: {(name,): cache.stats()[key] for name, cache in CACHES.items()}
+
+
+metrics.Collected(
+    "bot_cache_hits_total", "Cache lookups served from the cache.", "counter", ("cache",), _cache_stat("hits")
+)
+metrics.Collected(
+    "bot_cache_misses_total", "Cache lookups that went to the database.", "counter", ("cache",), _cache_stat("misses")
+)
+metrics.Collected(
+    "bot_cache_evictions_total", "Entries dropped to stay under the cap.", "counter", ("cache",),
+    _cache_stat("evictions"),
+)
+metrics.Collected("bot_cache_entries", "Entries currently cached.", "gauge", ("cache",), _cache_stat("size"))
+
+
+async def get_active_until(telegram_id: int):
+    """Cached subscription status of a user (end date, None or UNREGISTERED)."""
+    value = subscription_cache.get(telegram_id, _MISSING)
+    if value is _MISSING:
+        version = subscription_cache.version
+        value = await queries.get_subscription_status(telegram_id)
+        ttl = None if is_active(value) else SUB_CACHE_NEGATIVE_TTL
+        subscription_cache.set(telegram_id, value, version, ttl)
+    return value
+
+
+def is_active(value) -> bool:
+    """True if a cached status value is a subscription that has not ended."""
+    return isinstance(value, datetime.datetime) and value > datetime.datetime.now()
+
+
+async def warm_subscription_cache() -> int:
+    """Preload every active subscription (up to the cache cap); returns entries loaded."""
+    rows = await queries.get_active_subscription_ends(SUB_CACHE_MAX_ENTRIES)
+    for telegram_id, end_date in rows:
+        subscription_cache.set(telegram_id, end_date)
+    return len(rows)
+
+
+# ─── Cards & channels ───────────────────────────────────────────
+# Admin-managed configuration: read on every registration and approval,
+# changed only through the admin panel, which invalidates it. Other instances
+# sharing the database pick the change up when their copy expires.
+
+def _card_block(cards) -> str:
+    return "".join(f"💳 <code>{card.card_number}</code>\n👤 {card.card_holder}\n\n" for card in cards)
+
+
+class ConfigCache:
+    """Active cards and channels, loaded on first use and kept for `ttl` seconds or until invalidated.
+
+    As in TTLCache, a load that an invalidation overtook is returned but not kept.
+    """
+
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL):
+        self.ttl = ttl
+        self._cards = None
+        self._card_text = None
+        self._cards_until = 0.0
+        self._cards_version = 0
+        self._channels = None
+        self._channels_until = 0.0
+        self._channels_version = 0
+
+    async def cards(self) -> tuple:
+        if self._cards is None or time.monotonic() >= self._cards_until:
+            version = self._cards_version
+            expires = time.monotonic() + self.ttl
+            cards = tuple(await queries.get_active_cards())
+            if version != self._cards_version:
+                return cards
+            self._card_text = _card_block(cards)
+            self._cards = cards
+            self._cards_until = expires
+        return self._cards
+
+    async def card_text(self) -> str:
+        """Pre-rendered card block for the payment instructions ('' if no cards)."""
+        cards = await self.cards()
+        return self._card_text if cards is self._cards else _card_block(cards)
+
+    async def channels(self) -> tuple:
+        if self._channels is None or time.monotonic() >= self._channels_until:
+            version = self._channels_version
+            expires = time.monotonic() + self.ttl
+            channels = tuple(await queries.get_active_channels())
+            if version != self._channels_version:
+                return channels
+            self._channels = channels
+            self._channels_until = expires
+        return self._channels
+
+    def invalidate_cards(self):
+        self._cards_version += 1
+        self._cards = None
+        self._card_text = None
+
+    def invalidate_channels(self):
+        self._channels_version += 1
+        self._channels = None
+
+    async def warm(self):
+        await self.cards()
+        await self.channels()
+
+
+config_cache = ConfigCache()
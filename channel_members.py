@@ -0,0 +1,115 @@
+"""Channel members — who is in which channel, so expiry only kicks where needed.
+
+Rows are added when a join request is approved and kept in step by
+chat_member updates (handlers/membership.py). Updates can be missed while the
+bot is down, so a daily reconciliation asks Telegram (getChatMember) about
+recorded members whose subscription is no longer active (removed if they have
+left) and subscribers not yet recorded (added if they are there). It only
+corrects records; kicks come from the expiry path alone.
+
+A channel's records are trusted only after one complete reconciliation
+(`Channel.members_synced_at`); until then expiry kicks there unconditionally.
+"""
+
+import logging
+
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest
+
+import metrics
+import queries
+from cache import config_cache
+from delivery import DeliveryEngine
+from dispatcher import outbox_dispatcher
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK = 200
+
+PRESENT = {ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER}
+
+
+def is_present(member) -> bool:
+    """True if a ChatMember is in the chat (restricted users may or may not be)."""
+    if member.status == ChatMemberStatus.RESTRICTED:
+        return member.is_member
+    return member.status in PRESENT
+
+
+def kick_channels(channels, telegram_id: int, memberships: set) -> list:
+    """The channels to kick a user from: those they are recorded in, plus unsynced ones."""
+    return [
+        ch for ch in channels
+        if ch.members_synced_at is None or (ch.chat_id, telegram_id) in memberships
+    ]
+
+
+# ─── Reconciliation ─────────────────────────────────────────────
+
+async def _lookup(bot, engine, chat_id: int, telegram_ids: list):
+    """Yield (telegram_id, ChatMember or None if not in the chat); errors are raised after."""
+    results = await engine.run(
+        engine.call(None, bot.get_chat_member, chat_id=chat_id, user_id=telegram_id)
+        for telegram_id in telegram_ids
+    )
+    for telegram_id, result in zip(telegram_ids, results):
+        if isinstance(result, BadRequest):
+            # e.g. "user not found": never been a participant
+            result = None
+        yield telegram_id, result
+
+
+async def reconcile_channel(bot, engine, channel) -> dict:
+    """Bring one channel's records in line with Telegram; returns counts."""
+    chat_id = channel.chat_id
+    counts = {"added": 0, "removed": 0, "errors": 0}
+
+    after_id = 0
+    while True:
+        telegram_ids = await queries.get_unsubscribed_members(chat_id, after_id, RECONCILE_CHUNK)
+        if not telegram_ids:
+            break
+        after_id = telegram_ids[-1]
+        gone = []
+        async for telegram_id, member in _lookup(bot, engine, chat_id, telegram_ids):
+            if isinstance(member, Exception):
+                counts["errors"] += 1
+            elif member is None or not is_present(member):
+                gone.append(telegram_id)
+        await queries.remove_channel_members(chat_id, gone)
+        counts["removed"] += len(gone)
+
+    after_id = 0
+    while True:
+        telegram_ids = await queries.get_unrecorded_subscribers(chat_id, after_id, RECONCILE_CHUNK)
+        if not telegram_ids:
+            break
+        after_id = telegram_ids[-1]
+        present = []
+        async for telegram_id, member in _lookup(bot, engine, chat_id, telegram_ids):
+            if isinstance(member, Exception):
+                counts["errors"] += 1
+            elif member is not None and is_present(member):
+                present.append(telegram_id)
+        await queries.add_channel_members(chat_id, present)
+        counts["added"] += len(present)
+
+    if not counts["errors"]:
+        await queries.mark_members_synced(channel.id)
+    return counts
+
+
+@metrics.timed_job("members_reconcile")
+async def reconcile_job(context):
+    """Run daily before the subscription check: fix records from missed updates."""
+    # Share the dispatcher's rate limits when it is running
+    engine = outbox_dispatcher.engine or DeliveryEngine()
+    for channel in await config_cache.channels():
+        try:
+            counts = await reconcile_channel(context.bot, engine, channel)
+        except Exception as e:
+            logger.error(f"Membership reconciliation of {channel.chat_id} failed: {e}")
+            continue
+        logger.info(f"Membership reconciliation of {channel.chat_id}: {counts}")
+    # Pick up the new members_synced_at
+    config_cache.invalidate_channels()
@@ -1,4 +1,10 @@
+import asyncio
 import datetime
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from peewee import (
     SqliteDatabase,
     Model,
@@ -8,9 +14,84 @@ from peewee import (
     DateTimeField,
     ForeignKeyField,
     BooleanField,
+    TextField,
+    CompositeKey,
+)
+from playhouse import db_url
+from playhouse.pool import PooledDatabase
+
+import metrics
+from config import (
+    DB_WORKERS,
+    DB_SLOW_QUERY_MS,
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_POOL_STALE_TIMEOUT,
+    DB_PATH,
+    DB_JOURNAL_MODE,
+    DB_SYNCHRONOUS,
+    DB_CACHE_SIZE,
+    DB_MMAP_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+    DB_PER_THREAD_CONNECTIONS,
 )
 
-db = SqliteDatabase("bot.db")
+logger = logging.getLogger(__name__)
+
+
+def storage_options() -> dict:
+    """SqliteDatabase options for the configured storage profile.
+
+    WAL lets readers (join requests, status checks) proceed while the
+    scheduler writes; the pragmas are applied to every new connection.
+    """
+    return {
+        "pragmas": {
+            "journal_mode": DB_JOURNAL_MODE,
+            "synchronous": DB_SYNCHRONOUS,
+            "cache_size": DB_CACHE_SIZE,
+            "mmap_size": DB_MMAP_SIZE,
+            "busy_timeout": DB_BUSY_TIMEOUT_MS,
+        },
+        "timeout": DB_BUSY_TIMEOUT_MS / 1000,
+        "check_same_thread": DB_PER_THREAD_CONNECTIONS,
+    }
+
+
+def connect_database():
+    """Database for DATABASE_URL, or SQLite at DB_PATH when it is unset.
+
+    Connections come from a pool of up to DB_POOL_SIZE; one idle for longer
+    than DB_POOL_STALE_TIMEOUT is closed instead of reused. For SQLite the
+    storage profile above applies, and DB_PER_THREAD_CONNECTIONS=0 keeps a
+    single connection instead of a pool; DB calls then run one at a time.
+    """
+    url = DATABASE_URL or f"sqlite:///{DB_PATH}"
+    scheme, rest = url.split("://", 1)
+    scheme = scheme.split("+", 1)[0]
+    options = {}
+    if scheme in ("sqlite", "sqliteext"):
+        options = storage_options()
+        if not DB_PER_THREAD_CONNECTIONS:
+            return db_url.connect(f"{scheme}://{rest}", thread_safe=False, **options)
+        # Pooled connections move between threads
+        options["check_same_thread"] = False
+    return db_url.connect(
+        f"{scheme}+pool://{rest}",
+        max_connections=DB_POOL_SIZE,
+        stale_timeout=DB_POOL_STALE_TIMEOUT,
+        **options,
+    )
+
+
+db = connect_database()
+
+
+def write_transaction():
+    """db.atomic() for transactions that write; see "Async access" below."""
+    if isinstance(db, SqliteDatabase):
+        return db.atomic("IMMEDIATE")
+    return db.atomic()
 
 
 class BaseModel(Model):
@@ -40,18 +121,37 @@ class Channel(BaseModel):
     chat_id = BigIntegerField()
     title = CharField(default="")
     is_active = BooleanField(default=True)
+    # Last complete membership reconciliation; until then expiry kicks here unconditionally
+    members_synced_at = DateTimeField(null=True)
     created_at = DateTimeField(default=datetime.datetime.now)
 
 
+class ChannelMember(BaseModel):
+    """A user currently in a channel, kept from join approvals and chat_member updates."""
+    chat_id = BigIntegerField()
+    telegram_id = BigIntegerField(index=True)
+    joined_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "channel_member"
+        primary_key = CompositeKey("chat_id", "telegram_id")
+
+
 class Payment(BaseModel):
     user = ForeignKeyField(User, backref="payments")
     amount = IntegerField()
     receipt_file_id = CharField()
     status = CharField(default="pending")  # pending / approved / rejected
     approved_by = BigIntegerField(null=True)
-    created_at = DateTimeField(default=datetime.datetime.now)
+    created_at = DateTimeField(default=datetime.datetime.now, index=True)
     approved_at = DateTimeField(null=True)
 
+    class Meta:
+        indexes = (
+            # Admin payment list filtered by status, newest first
+            (("status", "created_at"), False),
+        )
+
 
 class Subscription(BaseModel):
     user = ForeignKeyField(User, backref="subscriptions")
@@ -61,7 +161,201 @@ class Subscription(BaseModel):
     is_active = BooleanField(default=True)
     warning_sent = BooleanField(default=False)
 
+    class Meta:
+        indexes = (
+            # Scheduler: expiring (not yet warned) subscriptions
+            (("is_active", "warning_sent", "end_date"), False),
+            # Scheduler: expired subscriptions; active-subscription counts
+            (("is_active", "end_date"), False),
+            # Join requests / status: the user's active subscription
+            (("user", "is_active"), False),
+        )
+
+
+class ArchivedPayment(BaseModel):
+    """An approved / rejected payment moved out of `payment` by archive.py; same id."""
+    id = IntegerField(primary_key=True)
+    user = ForeignKeyField(User, backref="archived_payments")
+    amount = IntegerField()
+    receipt_file_id = CharField()
+    status = CharField()
+    approved_by = BigIntegerField(null=True)
+    created_at = DateTimeField()
+    approved_at = DateTimeField(null=True)
+    archived_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "payment_archive"
+
+
+class ArchivedSubscription(BaseModel):
+    """An expired subscription moved out of `subscription` by archive.py; same id."""
+    id = IntegerField(primary_key=True)
+    user = ForeignKeyField(User, backref="archived_subscriptions")
+    payment_id = IntegerField(index=True)  # in payment or payment_archive
+    start_date = DateTimeField()
+    end_date = DateTimeField()
+    warning_sent = BooleanField()
+    archived_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "subscription_archive"
+
+
+class InviteLink(BaseModel):
+    """Per-user invite link to a channel, reused across renewals until expires_at."""
+    user = ForeignKeyField(User, backref="invite_links")
+    channel = ForeignKeyField(Channel, backref="invite_links")
+    invite_link = CharField()
+    expires_at = DateTimeField(null=True)  # None = stored without a lifetime, not reused
+    created_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "invite_link"
+        indexes = (
+            (("user", "channel"), True),
+        )
+
+
+class Outbox(BaseModel):
+    """Outgoing Telegram action, written with the change that causes it (see outbox.py)."""
+    action = CharField()  # warn / notify / kick / invite
+    chat_id = BigIntegerField()
+    payload = TextField(default="{}")  # JSON
+    idempotency_key = CharField(unique=True)
+    status = CharField(default="pending")  # pending / done / failed
+    attempts = IntegerField(default=0)
+    next_attempt_at = DateTimeField(default=datetime.datetime.now)
+    last_error = TextField(null=True)
+    created_at = DateTimeField(default=datetime.datetime.now)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "outbox"
+        indexes = (
+            (("status", "next_attempt_at"), False),
+        )
+
+
+class UserState(BaseModel):
+    """Persisted context.user_data of one user, as JSON (see persistence.py)."""
+    user_id = BigIntegerField(primary_key=True)
+    data = TextField()
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "user_state"
+
+
+class ConversationState(BaseModel):
+    """Current state of an unfinished conversation; ended ones are deleted."""
+    name = CharField()
+    key = CharField()  # JSON list, e.g. [chat_id, user_id]
+    state = TextField()  # JSON
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "conversation_state"
+        primary_key = CompositeKey("name", "key")
+
+
+class AdminMessage(BaseModel):
+    """An admin's copy of a payment receipt, edited when any admin decides."""
+    payment = ForeignKeyField(Payment, backref="admin_messages")
+    admin_id = BigIntegerField()
+    message_id = IntegerField()
+
+    class Meta:
+        table_name = "admin_message"
+        indexes = (
+            (("payment", "admin_id"), True),
+        )
+
+
+class MediaAsset(BaseModel):
+    """file_id Telegram gave a static file once uploaded, keyed by content hash (see media.py)."""
+    sha256 = CharField()
+    kind = CharField()  # photo / document / video / ...
+    file_id = CharField()
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "media_asset"
+        primary_key = CompositeKey("sha256", "kind")
+
+
+class Lease(BaseModel):
+    """A named lease held by one bot instance; token grows on every takeover (see leader.py)."""
+    name = CharField(primary_key=True)
+    holder = CharField()
+    token = IntegerField()
+    expires_at = DateTimeField()
+    heartbeat_at = DateTimeField()
+
+
+class StatCounter(BaseModel):
+    """Incrementally maintained statistics counters (see stats.py)."""
+    name = CharField(primary_key=True)
+    value = BigIntegerField(default=0)
+
+    class Meta:
+        table_name = "stat_counter"
+
+
+# ─── Async access ────────────────────────────────────────────────
+# Peewee is synchronous, so handlers never touch the models directly on the
+# event loop. Queries run on a small dedicated pool; each call checks a
+# connection out of the connection pool and hands it back when done.
+# On SQLite, write transactions (write_transaction) are BEGIN IMMEDIATE: a
+# deferred transaction that reads first cannot upgrade to a writer once
+# another connection has committed (WAL returns SQLITE_BUSY at once, ignoring
+# busy_timeout), while BEGIN IMMEDIATE simply waits for the write lock.
+
+# A single shared connection cannot carry interleaved transactions
+_executor = ThreadPoolExecutor(
+    max_workers=DB_WORKERS if isinstance(db, PooledDatabase) else 1, thread_name_prefix="db"
+)
+
+# name -> [calls, total seconds, max seconds]
+query_stats = {}
+
+
+def _timed_call(name, func, args, kwargs):
+    db.connect(reuse_if_open=True)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        if isinstance(db, PooledDatabase):
+            db.close()  # back to the pool
+        stat = query_stats.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+        metrics.db_query_seconds.observe(elapsed, name)
+        if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            logger.warning(f"Slow DB call {name}: {elapsed * 1000:.1f} ms")
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a synchronous DB function on the DB pool and await its result."""
+    loop = asyncio.get_running_loop()
+    name = getattr(func, "__name__", repr(func))
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(
+            _executor, functools.partial(_timed_call, name, func, args, kwargs)
+        )
+    finally:
+        metrics.record_db_wait(time.perf_counter() - start)
+
+
+def db_task(func):
+    """Decorator: turn a synchronous query function into an awaitable one."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
 
-def create_tables():
-    with db:
-        db.create_tables([User, Card, Channel, Payment, Subscription])
+    wrapper.sync = func
+    return wrapper
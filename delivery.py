@@ -0,0 +1,182 @@
+"""Delivery engine — concurrent Bot API calls under Telegram's rate limits."""
+
+import asyncio
+import datetime
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from config import DELIVERY_GLOBAL_RATE, DELIVERY_CONCURRENCY, DELIVERY_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits: ~1 msg/s to the same private chat, ~20 msg/min to the same group
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+
+# How often the engine drops per-chat buckets that have gone idle
+SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def is_idle(self, now: float) -> bool:
+        """True if nobody is waiting and the bucket has refilled, so a new one would behave the same."""
+        if self._lock.locked() or now < self._paused_until:
+            return False
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    def pause(self, seconds: float):
+        """Refuse tokens for the next `seconds` (used on RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DeliveryStats:
+    """Counters collected since the engine started or was last reported on."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def summary(self) -> str:
+        elapsed = self.elapsed
+        rate = self.succeeded / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.calls} calls in {elapsed:.1f}s ({rate:.1f}/s), "
+            f"{self.succeeded} ok, {self.failed} failed, {self.retries} retries"
+        )
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class DeliveryEngine:
+    """Runs Bot API calls concurrently while respecting global and per-chat limits.
+
+    Every call goes through a global token bucket (~30/s); messages also go
+    through a bucket for their target chat. `RetryAfter` pauses the buckets
+    and the call is retried. Per-chat buckets that have refilled are dropped
+    every SWEEP_INTERVAL, so a long-lived engine does not keep one per chat
+    ever messaged.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = DELIVERY_GLOBAL_RATE,
+        concurrency: int = DELIVERY_CONCURRENCY,
+        max_retries: int = DELIVERY_MAX_RETRIES,
+    ):
+        self.max_retries = max_retries
+        self.stats = DeliveryStats()
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._swept = time.monotonic()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _sweep(self, now: float):
+        self._swept = now
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.is_idle(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        now = time.monotonic()
+        if now - self._swept >= SWEEP_INTERVAL:
+            self._sweep(now)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = PRIVATE_CHAT_RATE if chat_id > 0 else GROUP_CHAT_RATE
+            bucket = TokenBucket(rate, capacity=1.0 if chat_id > 0 else 3.0)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def call(self, limit_chat, method, *args, **kwargs):
+        """Await `method(*args, **kwargs)` under the rate limits.
+
+        `limit_chat` is the chat whose per-chat message limit applies, or None
+        for calls that are not messages (bans, invite links) and only count
+        against the global limit. Returns the method's result; re-raises the
+        last error once retries are exhausted.
+        """
+        self.stats.calls += 1
+        bucket = self._bucket(limit_chat) if limit_chat is not None else None
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+            await self._global.acquire()
+            try:
+                async with self._semaphore:
+                    result = await method(*args, **kwargs)
+            except RetryAfter as e:
+                delay = _retry_seconds(e)
+                if bucket is not None:
+                    bucket.pause(delay)
+                self._global.pause(delay)
+                error = e
+            except BadRequest:
+                self.stats.failed += 1
+                raise
+            except NetworkError as e:
+                # Transient (includes TimedOut) — retry with exponential back-off
+                error = e
+            except Exception:
+                self.stats.failed += 1
+                raise
+            else:
+                self.stats.succeeded += 1
+                return result
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.stats.failed += 1
+                raise error
+            self.stats.retries += 1
+            logger.warning(f"Retrying {getattr(method, '__name__', method)} ({attempt}/{self.max_retries}): {error}")
+            if not isinstance(error, RetryAfter):
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def run(self, coroutines):
+        """Run a batch of coroutines concurrently; exceptions are returned, not raised."""
+        return await asyncio.gather(*coroutines, return_exceptions=True)
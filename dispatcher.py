@@ -0,0 +1,260 @@
+"""Outbox dispatcher — performs queued Telegram actions with a pool of workers.
+
+One feeder task claims due outbox rows in batches and hands them to
+`OUTBOX_WORKERS` workers; all Bot API calls share one DeliveryEngine, so the
+global and per-chat rate limits still hold. Throughput is tuned with
+OUTBOX_WORKERS / OUTBOX_BATCH_SIZE and the DELIVERY_* limits. The engine's
+call counts are logged and reset every REPORT_INTERVAL seconds.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+
+import metrics
+import outbox
+import queries
+from cache import config_cache
+from config import ADMIN_IDS, INVITE_LINK_DAYS, OUTBOX_WORKERS, OUTBOX_BATCH_SIZE
+from delivery import DeliveryEngine, DeliveryStats
+
+logger = logging.getLogger(__name__)
+
+# How often to look for due retries when nobody calls wake()
+POLL_INTERVAL = 5
+# How often to log delivery throughput and failures
+REPORT_INTERVAL = 300
+
+
+# ─── Actions ────────────────────────────────────────────────────
+
+async def _send_message(bot, engine, row, payload):
+    await engine.call(
+        row.chat_id,
+        bot.send_message,
+        chat_id=row.chat_id,
+        text=payload["text"],
+        parse_mode=payload.get("parse_mode"),
+    )
+
+
+async def _kick(bot, engine, row, payload):
+    await engine.call(None, bot.ban_chat_member, chat_id=row.chat_id, user_id=payload["user_id"])
+    # Immediately unban so they can rejoin later after payment
+    await engine.call(None, bot.unban_chat_member, chat_id=row.chat_id, user_id=payload["user_id"])
+    await queries.remove_channel_members(row.chat_id, [payload["user_id"]])
+    logger.info(f"Removed user {payload['user_id']} from channel {row.chat_id}")
+
+
+async def _invite(bot, engine, row, payload):
+    """Send a newly approved user the buttons to join every active channel."""
+    telegram_id = row.chat_id
+    channels = await config_cache.channels()
+
+    if not channels:
+        await engine.call(
+            telegram_id,
+            bot.send_message,
+            chat_id=telegram_id,
+            text=(
+                "🎉 <b>To'lovingiz tasdiqlandi!</b>\n\n"
+                "✅ Obunangiz 30 kunga faollashtirildi.\n\n"
+                "⚠️ Hozircha guruh/kanal qo'shilmagan. Admin tez orada qo'shadi."
+            ),
+            parse_mode="HTML",
+        )
+        return
+
+    links, failed = await _get_invite_links(bot, engine, payload["user_id"], telegram_id, channels)
+
+    buttons = [
+        [InlineKeyboardButton(f"📢 {ch.title or f'Guruh #{ch.id}'}", url=links[ch.id])]
+        for ch in channels
+        if ch.id in links
+    ]
+    if buttons:
+        text = (
+            "🎉 <b>To'lovingiz tasdiqlandi!</b>\n\n"
+            "✅ Obunangiz 30 kunga faollashtirildi.\n\n"
+            "Quyidagi tugmalarni bosib guruh/kanallarga qo'shiling:"
+        )
+    else:
+        text = (
+            "🎉 <b>To'lovingiz tasdiqlandi!</b>\n\n"
+            "✅ Obunangiz 30 kunga faollashtirildi.\n\n"
+            "⚠️ Havolalarni yaratib bo'lmadi. Admin tez orada yuboradi."
+        )
+
+    # A failed send raises, so the whole action is retried; links created so
+    # far are stored and reused by the retry.
+    await engine.call(
+        telegram_id,
+        bot.send_message,
+        chat_id=telegram_id,
+        text=text,
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(buttons) if buttons else None,
+    )
+
+    if failed:
+        details = "\n".join(f"• {ch.title}: {e}" for ch, e in failed)
+        for admin_id in ADMIN_IDS:
+            try:
+                await engine.call(
+                    admin_id,
+                    bot.send_message,
+                    chat_id=admin_id,
+                    text=f"⚠️ Userga ({telegram_id}) havola yuborishda xato:\n{details}",
+                )
+            except Exception:
+                logger.error(f"Failed to notify admin {admin_id} about invite errors.")
+
+
+async def _get_invite_links(bot, engine, user_id, telegram_id, channels):
+    """Return ({channel id: invite link}, [(channel, error)]) for the user.
+
+    Stored links are reused for INVITE_LINK_DAYS; missing or older ones are
+    created concurrently and saved. Join requests through them are still
+    checked against the subscription, so the links themselves never expire
+    in Telegram; the bounded reuse only stops revoked links being sent.
+    Creation is an admin call, so it uses the global rate limit only.
+    """
+    links = await queries.get_valid_invite_links(user_id)
+    missing = [ch for ch in channels if ch.id not in links]
+    expires_at = datetime.datetime.now() + datetime.timedelta(days=INVITE_LINK_DAYS)
+
+    results = await engine.run(
+        engine.call(
+            None,
+            bot.create_chat_invite_link,
+            chat_id=ch.chat_id,
+            creates_join_request=True,
+            name=f"user_{telegram_id}",
+        )
+        for ch in missing
+    )
+
+    created, failed = {}, []
+    for ch, result in zip(missing, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to create invite link to {ch.chat_id} for user {telegram_id}: {result}")
+            failed.append((ch, result))
+        else:
+            created[ch.id] = result.invite_link
+
+    await queries.save_invite_links(user_id, created, expires_at)
+    links.update(created)
+    return links, failed
+
+
+ACTIONS = {
+    outbox.WARN: _send_message,
+    outbox.NOTIFY: _send_message,
+    outbox.KICK: _kick,
+    outbox.INVITE: _invite,
+}
+
+
+# ─── Dispatcher ─────────────────────────────────────────────────
+
+class OutboxDispatcher:
+    """Drains the outbox until stopped; call `wake()` after queueing actions."""
+
+    def __init__(self, workers: int = OUTBOX_WORKERS, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.engine = None
+        self._bot = None
+        self._queue = None
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def start(self, bot):
+        self._bot = bot
+        self.engine = DeliveryEngine()
+        # Claimed rows wait here at most one batch deep, well within their lease
+        self._queue = asyncio.Queue(maxsize=self.batch_size)
+        self._tasks = [asyncio.create_task(self._feed(), name="outbox_feed")]
+        self._tasks += [
+            asyncio.create_task(self._work(), name=f"outbox_worker_{i}") for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._report(), name="outbox_report"))
+        logger.info(f"Outbox dispatcher started with {self.workers} workers")
+
+    async def stop(self):
+        # Rows claimed but not yet done become due again when their lease ends
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.engine is not None:
+            self._log_stats()
+
+    def _log_stats(self):
+        stats, self.engine.stats = self.engine.stats, DeliveryStats()
+        if stats.calls:
+            logger.info(f"Outbox delivery: {stats.summary()}")
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            self._log_stats()
+
+    async def _feed(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = await outbox.claim(self.batch_size)
+            except Exception as e:
+                logger.error(f"Failed to claim outbox rows: {e}")
+                rows = []
+            for row in rows:
+                await self._queue.put(row)
+            if len(rows) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _work(self):
+        while True:
+            row = await self._queue.get()
+            try:
+                await self._perform(row)
+            except Exception as e:
+                logger.error(f"Outbox worker failed on #{row.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _perform(self, row):
+        try:
+            await ACTIONS[row.action](self._bot, self.engine, row, json.loads(row.payload))
+        except (BadRequest, Forbidden) as e:
+            # Retrying cannot help (blocked bot, missing chat, bad parameters)
+            await outbox.fail(row, str(e), permanent=True)
+            logger.error(f"Outbox {row.action} #{row.id} to {row.chat_id} failed permanently: {e}")
+        except Exception as e:
+            gave_up = await outbox.fail(row, str(e))
+            if gave_up:
+                logger.error(f"Outbox {row.action} #{row.id} to {row.chat_id} gave up after {row.attempts} attempts: {e}")
+            else:
+                logger.warning(f"Outbox {row.action} #{row.id} to {row.chat_id} failed (attempt {row.attempts}): {e}")
+        else:
+            await outbox.complete(row.id)
+
+
+outbox_dispatcher = OutboxDispatcher()
+
+
+@metrics.timed_job("outbox_purge")
+async def purge_job(context):
+    """Delete old completed outbox rows (run daily by the job queue)."""
+    deleted = await outbox.purge_done()
+    logger.info(f"Outbox purge: {deleted} completed actions deleted")
@@ -15,7 +15,13 @@ from telegram.ext import (
 )
 
 from config import ADMIN_IDS, MONTHLY_PRICE
-from database import User, Payment, Subscription, Card, Channel
+import metrics
+import queries
+import stats
+from cache import config_cache
+from profiler import profiler
+from scheduler import check_subscriptions
+from leader import LeaseLost, scheduler_lease
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +35,7 @@ logger = logging.getLogger(__name__)
 
 # ─── Main admin menu ─────────────────────────────────────────────
 
+@metrics.timed("admin.admin_command")
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show admin panel with inline buttons."""
     if update.effective_user.id not in ADMIN_IDS:
@@ -55,8 +62,100 @@ async def _show_admin_menu(reply_func, **kwargs):
     )
 
 
+# ─── /profile ────────────────────────────────────────────────────
+
+PROFILE_DEFAULT_UPDATES = 100
+PROFILE_MAX_SECONDS = 300
+
+
+@metrics.timed("admin.profile_command")
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start a profiling session: /profile [N | Ns | check]."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    arg = context.args[0].lower() if context.args else str(PROFILE_DEFAULT_UPDATES)
+    chat_id = update.effective_chat.id
+
+    if arg == "check":
+        if not scheduler_lease.may_run:
+            await update.message.reply_text("⚠️ Tekshiruv boshqa nusxada (lider) ishlaydi.")
+            return
+        await update.message.reply_text("🔬 Obuna tekshiruvi profil qilinmoqda...")
+        # As a job, so the check does not hold up this admin's other updates
+        context.job_queue.run_once(_profile_check, 0, chat_id=chat_id, name="profile_check")
+        return
+
+    try:
+        if arg.endswith("s"):
+            max_updates, max_seconds = 0, min(float(arg[:-1]), PROFILE_MAX_SECONDS)
+        else:
+            max_updates, max_seconds = int(arg), PROFILE_MAX_SECONDS
+    except ValueError:
+        await update.message.reply_text(
+            "Foydalanish: /profile [N | Ns | check]\n"
+            "• /profile 200 — keyingi 200 ta update\n"
+            "• /profile 30s — 30 soniya\n"
+            "• /profile check — obuna tekshiruvi"
+        )
+        return
+    if max_seconds <= 0 or max_updates < 0:
+        await update.message.reply_text("❌ Musbat son kiriting.")
+        return
+
+    if not profiler.start(context.bot, chat_id, max_updates, max_seconds):
+        await update.message.reply_text("⚠️ Profil allaqachon ishlamoqda.")
+        return
+    limit = f"{max_updates} ta update yoki {max_seconds:.0f} s" if max_updates else f"{max_seconds:.0f} s"
+    await update.message.reply_text(f"🔬 Profil yoqildi ({limit}). Hisobot tayyor bo'lgach yuboriladi.")
+
+
+async def _profile_check(context: ContextTypes.DEFAULT_TYPE):
+    """Job: run the subscription check under the profiler for /profile check."""
+    chat_id = context.job.chat_id
+    try:
+        if not await profiler.run(context.bot, chat_id, check_subscriptions(context)):
+            await context.bot.send_message(chat_id=chat_id, text="⚠️ Profil allaqachon ishlamoqda.")
+    except LeaseLost as e:
+        logger.warning(f"Profiled subscription check stopped: {e}")
+        await context.bot.send_message(
+            chat_id=chat_id, text="⚠️ Bu nusxa lider emas endi, tekshiruv to'xtatildi."
+        )
+
+
 # ─── Callback handler ────────────────────────────────────────────
 
+# Buttons whose callback data carries ids; metrics label them by prefix only
+_PARAM_BRANCHES = (
+    "admin_payments_page_",
+    "admin_payments_f_",
+    "admin_pay_detail_",
+    "admin_del_card_",
+    "admin_del_ch_",
+)
+_FIXED_BRANCHES = {
+    "admin_stats",
+    "admin_cards",
+    "admin_channels",
+    "admin_payments",
+    "admin_back",
+    "admin_add_card",
+    "admin_add_channel",
+}
+
+
+def _callback_branch(update: Update, context) -> str:
+    """Metrics label for an admin button press (bounded: unknown data → 'other')."""
+    data = update.callback_query.data or ""
+    if data in _FIXED_BRANCHES:
+        return f"admin_callback.{data}"
+    for prefix in _PARAM_BRANCHES:
+        if data.startswith(prefix):
+            return f"admin_callback.{prefix.rstrip('_')}"
+    return "admin_callback.other"
+
+
+@metrics.timed(_callback_branch)
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin panel inline button presses."""
     query = update.callback_query
@@ -70,23 +169,18 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Statistics ──
     if data == "admin_stats":
-        total_users = User.select().count()
-        active_subs = Subscription.select().where(Subscription.is_active == True).count()
-        total_payments = Payment.select().count()
-        approved = Payment.select().where(Payment.status == "approved").count()
-        pending = Payment.select().where(Payment.status == "pending").count()
-        rejected = Payment.select().where(Payment.status == "rejected").count()
+        counts = await stats.get_stats()
         price_fmt = f"{MONTHLY_PRICE:,}".replace(",", " ")
 
         text = (
             f"📊 <b>Statistika</b>\n\n"
-            f"👥 Jami foydalanuvchilar: <b>{total_users}</b>\n"
-            f"✅ Aktiv obunalar: <b>{active_subs}</b>\n\n"
+            f"👥 Jami foydalanuvchilar: <b>{counts['total_users']}</b>\n"
+            f"✅ Aktiv obunalar: <b>{counts['active_subs']}</b>\n\n"
             f"💰 <b>To'lovlar:</b>\n"
-            f"  📋 Jami: {total_payments}\n"
-            f"  ✅ Tasdiqlangan: {approved}\n"
-            f"  ⏳ Kutilmoqda: {pending}\n"
-            f"  ❌ Rad etilgan: {rejected}\n\n"
+            f"  📋 Jami: {counts['total_payments']}\n"
+            f"  ✅ Tasdiqlangan: {counts['approved']}\n"
+            f"  ⏳ Kutilmoqda: {counts['pending']}\n"
+            f"  ❌ Rad etilgan: {counts['rejected']}\n\n"
             f"💵 Oylik narx: {price_fmt} so'm"
         )
         keyboard = InlineKeyboardMarkup(
@@ -103,22 +197,34 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await _show_channels(query)
 
     # ── Recent payments ──
-    elif data == "admin_payments" or data.startswith("admin_payments_page_"):
-        if data == "admin_payments":
-            page = 0
-        else:
-            page = int(data.split("_")[-1])
+    elif data.startswith("admin_payments"):
+        # admin_payments | admin_payments_f_<s> | admin_payments_page_<s>_<dir>_<cursor>_<page>
+        parts = data.split("_")
+        status_code, direction, cursor, page = "x", "start", None, 0
+        if len(parts) == 4 and parts[2] == "f":
+            status_code = parts[3]
+        elif len(parts) == 8 and parts[2] == "page":
+            status_code = parts[3]
+            direction = _DIRECTIONS.get(parts[4], "start")
+            cursor = _decode_cursor(parts[5], parts[6])
+            page = int(parts[7])
 
         # If returning from photo detail, delete photo and send new text
         is_photo = query.message.photo if query.message else False
-        await _show_payments_page(query, page, from_photo=bool(is_photo))
+        await _show_payments_page(
+            query, status_code, direction, cursor, page, from_photo=bool(is_photo)
+        )
 
     # ── Payment detail ──
     elif data.startswith("admin_pay_detail_"):
+        # admin_pay_detail_<id>_<s>_<cursor>_<page> — the tail reopens the same page
         parts = data.split("_")
         payment_id = int(parts[3])
-        from_page = int(parts[4]) if len(parts) > 4 else 0
-        await _show_payment_detail(query, context, payment_id, from_page)
+        if len(parts) == 8:
+            back_data = f"admin_payments_page_{parts[4]}_s_{parts[5]}_{parts[6]}_{parts[7]}"
+        else:
+            back_data = "admin_payments"
+        await _show_payment_detail(query, context, payment_id, back_data)
 
     # ── Back to menu ──
     elif data == "admin_back":
@@ -138,11 +244,11 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ── Delete card ──
     elif data.startswith("admin_del_card_"):
         card_id = int(data.split("_")[-1])
-        try:
-            card = Card.get_by_id(card_id)
-            card.delete_instance()
+        deleted = await queries.delete_card(card_id)
+        config_cache.invalidate_cards()
+        if deleted:
             await query.answer("🗑 Karta o'chirildi!", show_alert=True)
-        except Card.DoesNotExist:
+        else:
             await query.answer("Karta topilmadi.", show_alert=True)
         await _show_cards(query)
 
@@ -158,11 +264,11 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ── Delete channel ──
     elif data.startswith("admin_del_ch_"):
         ch_id = int(data.split("_")[-1])
-        try:
-            ch = Channel.get_by_id(ch_id)
-            ch.delete_instance()
+        deleted = await queries.delete_channel(ch_id)
+        config_cache.invalidate_channels()
+        if deleted:
             await query.answer("🗑 Kanal o'chirildi!", show_alert=True)
-        except Channel.DoesNotExist:
+        else:
             await query.answer("Kanal topilmadi.", show_alert=True)
         await _show_channels(query)
 
@@ -171,7 +277,7 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def _show_cards(query):
     """Show the list of active cards with delete buttons."""
-    cards = Card.select().where(Card.is_active == True)
+    cards = await config_cache.cards()
     text = "💳 <b>Kartalar</b>\n\n"
 
     buttons = []
@@ -192,7 +298,7 @@ async def _show_cards(query):
 
 async def _show_channels(query):
     """Show the list of active channels with delete buttons."""
-    channels = Channel.select().where(Channel.is_active == True)
+    channels = await config_cache.channels()
     text = "📺 <b>Kanallar / Guruhlar</b>\n\n"
 
     buttons = []
@@ -212,18 +318,56 @@ async def _show_channels(query):
 
 
 # ─── Payments pagination ─────────────────────────────────────────
+# Keyset pagination on (created_at, id): callback data carries the cursor of
+# the page edge instead of an OFFSET, so every page costs one index range scan.
 
 PAGE_SIZE = 20
 
+# Short status codes used in callback data (limited to 64 bytes)
+_STATUS_CODES = {"x": None, "p": "pending", "a": "approved", "r": "rejected"}
+_STATUS_FILTERS = [("x", "Barchasi"), ("p", "⏳"), ("a", "✅"), ("r", "❌")]
+_DIRECTIONS = {"n": "next", "p": "prev", "s": "start"}
 
-async def _show_payments_page(query, page: int, from_photo: bool = False):
-    """Show a paginated list of payments as inline buttons."""
-    total = Payment.select().count()
+_EPOCH = datetime.datetime(1970, 1, 1)
 
-    if total == 0:
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("🔙 Orqaga", callback_data="admin_back")]]
+
+def _encode_cursor(payment) -> str:
+    """Encode a payment's (created_at, id) as '<base36 µs>_<id>'."""
+    micros = (payment.created_at - _EPOCH) // datetime.timedelta(microseconds=1)
+    digits = ""
+    while True:
+        micros, r = divmod(micros, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[r] + digits
+        if micros == 0:
+            break
+    return f"{digits}_{payment.id}"
+
+
+def _decode_cursor(ts: str, payment_id: str) -> tuple:
+    created_at = _EPOCH + datetime.timedelta(microseconds=int(ts, 36))
+    return created_at, int(payment_id)
+
+
+async def _show_payments_page(
+    query, status_code: str, direction: str, cursor, page: int, from_photo: bool = False
+):
+    """Show a page of payments as inline buttons, optionally filtered by status."""
+    status = _STATUS_CODES.get(status_code)
+    total = await stats.get_payment_count(status)
+
+    filter_buttons = [
+        InlineKeyboardButton(
+            f"• {label}" if code == status_code else label,
+            callback_data=f"admin_payments_f_{code}",
         )
+        for code, label in _STATUS_FILTERS
+    ]
+
+    if total == 0:
+        rows = [[InlineKeyboardButton("🔙 Orqaga", callback_data="admin_back")]]
+        if status:
+            rows.insert(0, filter_buttons)
+        keyboard = InlineKeyboardMarkup(rows)
         if from_photo:
             try:
                 await query.message.delete()
@@ -237,38 +381,47 @@ async def _show_payments_page(query, page: int, from_photo: bool = False):
         return
 
     total_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
-    page = max(0, min(page, total_pages - 1))
-
-    payments = (
-        Payment.select(Payment, User)
-        .join(User)
-        .order_by(Payment.created_at.desc())
-        .offset(page * PAGE_SIZE)
-        .limit(PAGE_SIZE)
-    )
+
+    payments, has_more = await queries.get_payments_page(status, direction, cursor, PAGE_SIZE)
+    if direction == "prev":
+        has_newer, has_older = has_more, True
+        if not has_more:
+            page = 0
+    else:
+        has_newer, has_older = page > 0, has_more
+    page = min(page, total_pages - 1)
 
     text = f"💰 <b>To'lovlar</b> (sahifa {page + 1}/{total_pages}, jami: {total})\n\n"
     text += "To'lovni ko'rish uchun ustiga bosing:"
 
     emoji_map = {"pending": "⏳", "approved": "✅", "rejected": "❌"}
-    buttons = []
+    buttons = [filter_buttons]
+    page_anchor = _encode_cursor(payments[0]) if payments else None
 
     for p in payments:
         e = emoji_map.get(p.status, "❓")
         price = f"{p.amount:,}".replace(",", " ")
         label = f"{e} #{p.id} | {p.user.first_name} {p.user.last_name} | {price} | {p.created_at:%d.%m}"
         buttons.append(
-            [InlineKeyboardButton(label, callback_data=f"admin_pay_detail_{p.id}_{page}")]
+            [InlineKeyboardButton(
+                label, callback_data=f"admin_pay_detail_{p.id}_{status_code}_{page_anchor}_{page}"
+            )]
         )
 
     nav_buttons = []
-    if page > 0:
+    if payments and has_newer:
         nav_buttons.append(
-            InlineKeyboardButton("◀️ Oldingi", callback_data=f"admin_payments_page_{page - 1}")
+            InlineKeyboardButton(
+                "◀️ Oldingi",
+                callback_data=f"admin_payments_page_{status_code}_p_{page_anchor}_{page - 1}",
+            )
         )
-    if page < total_pages - 1:
+    if payments and has_older:
         nav_buttons.append(
-            InlineKeyboardButton("Keyingi ▶️", callback_data=f"admin_payments_page_{page + 1}")
+            InlineKeyboardButton(
+                "Keyingi ▶️",
+                callback_data=f"admin_payments_page_{status_code}_n_{_encode_cursor(payments[-1])}_{page + 1}",
+            )
         )
 
     if nav_buttons:
@@ -282,7 +435,6 @@ async def _show_payments_page(query, page: int, from_photo: bool = False):
             await query.message.delete()
         except Exception:
             pass
-        from telegram.ext import ContextTypes
         await query.get_bot().send_message(
             chat_id=query.from_user.id, text=text, parse_mode="HTML", reply_markup=markup
         )
@@ -290,11 +442,12 @@ async def _show_payments_page(query, page: int, from_photo: bool = False):
         await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
 
 
-async def _show_payment_detail(query, context, payment_id: int, from_page: int):
+async def _show_payment_detail(query, context, payment_id: int, back_data: str):
     """Show full payment details with receipt photo."""
-    try:
-        payment = Payment.select(Payment, User).join(User).where(Payment.id == payment_id).get()
-    except Payment.DoesNotExist:
+    payment = await queries.get_payment(payment_id)
+    if payment is None:
+        payment = await queries.get_archived_payment(payment_id)
+    if payment is None:
         await query.answer("To'lov topilmadi.", show_alert=True)
         return
 
@@ -315,9 +468,11 @@ async def _show_payment_detail(query, context, payment_id: int, from_page: int):
 
     if payment.approved_at:
         text += f"✅ Tasdiqlangan: {payment.approved_at:%d.%m.%Y %H:%M}\n"
+    if getattr(payment, "archived_at", None):
+        text += f"🗄 Arxivlangan: {payment.archived_at:%d.%m.%Y}\n"
 
     keyboard = InlineKeyboardMarkup(
-        [[InlineKeyboardButton("🔙 Orqaga", callback_data=f"admin_payments_page_{from_page}")]]
+        [[InlineKeyboardButton("🔙 Orqaga", callback_data=back_data)]]
     )
 
     # Delete old message and send photo with details
@@ -337,6 +492,7 @@ async def _show_payment_detail(query, context, payment_id: int, from_page: int):
 
 # ─── Conversation states for adding card / channel ─────────────
 
+@metrics.timed("admin.receive_card_number")
 async def receive_card_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin entered card number, now ask for holder name."""
     context.user_data["new_card_number"] = update.message.text.strip()
@@ -344,12 +500,14 @@ async def receive_card_number(update: Update, context: ContextTypes.DEFAULT_TYPE
     return WAIT_CARD_HOLDER
 
 
+@metrics.timed("admin.receive_card_holder")
 async def receive_card_holder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin entered card holder, save card to DB."""
     card_number = context.user_data.pop("new_card_number")
     card_holder = update.message.text.strip()
 
-    Card.create(card_number=card_number, card_holder=card_holder, is_active=True)
+    await queries.add_card(card_number, card_holder)
+    config_cache.invalidate_cards()
 
     await update.message.reply_text(
         f"✅ Karta qo'shildi!\n\n"
@@ -361,6 +519,7 @@ async def receive_card_holder(update: Update, context: ContextTypes.DEFAULT_TYPE
     return ConversationHandler.END
 
 
+@metrics.timed("admin.receive_channel_id")
 async def receive_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin entered channel/group ID — verify bot membership and permissions."""
     text = update.message.text.strip()
@@ -427,7 +586,8 @@ async def receive_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # ── All checks passed — save directly ──
     title = chat.title or f"Kanal #{chat_id}"
-    Channel.create(chat_id=chat_id, title=title, is_active=True)
+    await queries.add_channel(chat_id, title)
+    config_cache.invalidate_channels()
 
     await update.message.reply_text(
         f"✅ Kanal qo'shildi!\n\n"
@@ -438,6 +598,7 @@ async def receive_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ConversationHandler.END
 
 
+@metrics.timed("admin.admin_cancel")
 async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel admin conversation flow."""
     await update.message.reply_text("❌ Bekor qilindi. /admin bosing.")
@@ -467,10 +628,13 @@ def get_admin_handlers():
         },
         fallbacks=[CommandHandler("cancel", admin_cancel)],
         per_message=False,
+        name="admin",
+        persistent=True,
     )
 
     return [
         CommandHandler("admin", admin_command),
+        CommandHandler("profile", profile_command),
         admin_conv,
         CallbackQueryHandler(admin_callback, pattern=r"^admin_"),
     ]
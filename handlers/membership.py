@@ -1,48 +1,31 @@
-"""Handle channel/group join requests — auto-approve users with active subscriptions."""
+"""Handle channel/group join requests — auto-approve users with active subscriptions.
+
+Approvals, joins and leaves also keep the channel_member table up to date.
+"""
 
 import logging
 
 from telegram import Update
-from telegram.ext import ChatJoinRequestHandler, ContextTypes
+from telegram.ext import ChatJoinRequestHandler, ChatMemberHandler, ContextTypes
 
-from database import User, Subscription
+import metrics
+import queries
+from cache import config_cache, get_active_until, is_active
+from queries import UNREGISTERED
+from channel_members import is_present
 
 logger = logging.getLogger(__name__)
 
 
+@metrics.timed("membership.handle_join_request")
 async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Approve or decline join requests based on subscription status."""
     join_request = update.chat_join_request
     telegram_id = join_request.from_user.id
 
-    try:
-        user = User.get(User.telegram_id == telegram_id)
-        active_sub = (
-            Subscription.select()
-            .where(
-                (Subscription.user == user) & (Subscription.is_active == True)
-            )
-            .first()
-        )
-
-        if active_sub:
-            await join_request.approve()
-            logger.info(f"Approved join request for user {telegram_id}")
-        else:
-            await join_request.decline()
-            try:
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=(
-                        "❌ Obunangiz faol emas.\n\n"
-                        "To'lov qilish uchun /start bosing."
-                    ),
-                )
-            except Exception:
-                pass
-            logger.info(f"Declined join request for user {telegram_id} — no active subscription")
-
-    except User.DoesNotExist:
+    active_until = await get_active_until(telegram_id)
+
+    if active_until == UNREGISTERED:
         await join_request.decline()
         try:
             await context.bot.send_message(
@@ -56,7 +39,46 @@ async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE
             pass
         logger.info(f"Declined join request for unregistered user {telegram_id}")
 
+    elif is_active(active_until):
+        await join_request.approve()
+        await queries.add_channel_members(join_request.chat.id, [telegram_id])
+        logger.info(f"Approved join request for user {telegram_id}")
+
+    else:
+        await join_request.decline()
+        try:
+            await context.bot.send_message(
+                chat_id=telegram_id,
+                text=(
+                    "❌ Obunangiz faol emas.\n\n"
+                    "To'lov qilish uchun /start bosing."
+                ),
+            )
+        except Exception:
+            pass
+        logger.info(f"Declined join request for user {telegram_id} — no active subscription")
+
+
+@metrics.timed("membership.handle_chat_member")
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record joins and leaves in the managed channels."""
+    change = update.chat_member
+    chat_id = change.chat.id
+    if not any(ch.chat_id == chat_id for ch in await config_cache.channels()):
+        return
+
+    member = change.new_chat_member
+    if member.user.is_bot:
+        return
+    if is_present(member):
+        await queries.add_channel_members(chat_id, [member.user.id])
+    else:
+        await queries.remove_channel_members(chat_id, [member.user.id])
+
 
-def get_membership_handler():
-    """Return the join request handler."""
-    return ChatJoinRequestHandler(handle_join_request)
+def get_membership_handlers():
+    """Return the join request and chat member handlers."""
+    return [
+        ChatJoinRequestHandler(handle_join_request),
+        ChatMemberHandler(handle_chat_member, ChatMemberHandler.CHAT_MEMBER),
+    ]
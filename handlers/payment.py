@@ -1,17 +1,71 @@
 """Payment approval / rejection handler for admin inline buttons."""
 
-import datetime
+import asyncio
 import logging
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import CallbackQueryHandler, ContextTypes
 
 from config import ADMIN_IDS
-from database import Payment, Subscription, User, Channel
+import metrics
+import outbox
+import queries
+from cache import subscription_cache
+from dispatcher import outbox_dispatcher
+from scheduler import expiry_timers
 
 logger = logging.getLogger(__name__)
 
 
+async def _mark_decided(query, payment_id: int, decision: str):
+    """Append the decision to every admin's copy of the receipt, in parallel.
+
+    The other admins' copies are marked as decided by another admin and lose
+    their buttons, so nobody has to press them to find out.
+    """
+    caption = query.message.caption
+    decided_by = query.from_user.id
+    copies = [
+        (admin_id, message_id) for admin_id, message_id in await queries.get_admin_messages(payment_id)
+        if admin_id != decided_by
+    ]
+    results = await asyncio.gather(
+        query.edit_message_caption(caption=caption + f"\n\n{decision}", parse_mode="HTML"),
+        *(
+            query.get_bot().edit_message_caption(
+                chat_id=admin_id,
+                message_id=message_id,
+                caption=caption + f"\n\n{decision} (boshqa admin tomonidan)",
+                parse_mode="HTML",
+            )
+            for admin_id, message_id in copies
+        ),
+        return_exceptions=True,
+    )
+    if isinstance(results[0], Exception):
+        raise results[0]
+    for (admin_id, _), result in zip(copies, results[1:]):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to update receipt copy of admin {admin_id}: {result}")
+
+
+async def _already_decided(query, status: str):
+    """Tell an admin whose click lost that the payment was decided by someone else."""
+    status_text = "✅ TASDIQLANGAN" if status == "approved" else "❌ RAD ETILGAN"
+    await query.answer(
+        f"Bu to'lov allaqachon {status_text.lower()}.", show_alert=True
+    )
+    # Remove buttons from this admin's message too
+    try:
+        await query.edit_message_caption(
+            caption=query.message.caption + f"\n\n{status_text} (boshqa admin tomonidan)",
+            parse_mode="HTML",
+        )
+    except Exception:
+        pass
+
+
+@metrics.timed("payment.handle_payment_decision")
 async def handle_payment_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process admin's approve/reject button press."""
     query = update.callback_query
@@ -25,128 +79,59 @@ async def handle_payment_decision(update: Update, context: ContextTypes.DEFAULT_
     action, payment_id = data.split("_", 1)
     payment_id = int(payment_id)
 
-    try:
-        payment = Payment.get_by_id(payment_id)
-    except Payment.DoesNotExist:
+    payment = await queries.get_payment(payment_id)
+    if payment is None:
         await query.edit_message_caption(
             caption="❌ To'lov topilmadi.", parse_mode="HTML"
         )
         return
 
     if payment.status != "pending":
-        status_text = "✅ TASDIQLANGAN" if payment.status == "approved" else "❌ RAD ETILGAN"
-        await query.answer(
-            f"Bu to'lov allaqachon {status_text.lower()}.", show_alert=True
-        )
-        # Remove buttons from this admin's message too
-        try:
-            await query.edit_message_caption(
-                caption=query.message.caption + f"\n\n{status_text} (boshqa admin tomonidan)",
-                parse_mode="HTML",
-            )
-        except Exception:
-            pass
+        await _already_decided(query, payment.status)
         return
 
     user = payment.user
 
     if action == "approve":
-        # Update payment
-        payment.status = "approved"
-        payment.approved_by = query.from_user.id
-        payment.approved_at = datetime.datetime.now()
-        payment.save()
-
-        # Create subscription (1 month)
-        now = datetime.datetime.now()
-        end = now + datetime.timedelta(days=30)
-        Subscription.create(
-            user=user,
-            payment=payment,
-            start_date=now,
-            end_date=end,
-            is_active=True,
-            warning_sent=False,
-        )
-
-        # Update admin message
-        await query.edit_message_caption(
-            caption=query.message.caption + "\n\n✅ <b>TASDIQLANDI</b>",
-            parse_mode="HTML",
+        # Update payment and create subscription (1 month); the invite
+        # is queued in the same transaction and sent by the dispatcher
+        invite = outbox.Action(
+            outbox.INVITE, user.telegram_id, {"user_id": user.id}, f"invite:{payment.id}"
         )
-
-        # Build inline buttons for all active channels/groups
-        channels = Channel.select().where(Channel.is_active == True)
-
-        if not channels:
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=(
-                    "🎉 <b>To'lovingiz tasdiqlandi!</b>\n\n"
-                    "✅ Obunangiz 30 kunga faollashtirildi.\n\n"
-                    "⚠️ Hozircha guruh/kanal qo'shilmagan. Admin tez orada qo'shadi."
-                ),
-                parse_mode="HTML",
-            )
+        sub = await queries.approve_payment(payment, query.from_user.id, actions=[invite])
+        if sub is None:
+            # Another admin decided between the read above and this update
+            await _already_decided(query, (await queries.get_payment(payment.id)).status)
             return
+        outbox_dispatcher.wake()
+        subscription_cache.invalidate(user.telegram_id)
+        expiry_timers.schedule(sub)
 
-        try:
-            buttons = []
-            for ch in channels:
-                invite_link = await context.bot.create_chat_invite_link(
-                    chat_id=ch.chat_id,
-                    creates_join_request=True,
-                    name=f"user_{user.telegram_id}",
-                )
-                title = ch.title or f"Guruh #{ch.id}"
-                buttons.append(
-                    [InlineKeyboardButton(f"📢 {title}", url=invite_link.invite_link)]
-                )
-
-            keyboard = InlineKeyboardMarkup(buttons)
-
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=(
-                    "🎉 <b>To'lovingiz tasdiqlandi!</b>\n\n"
-                    "✅ Obunangiz 30 kunga faollashtirildi.\n\n"
-                    "Quyidagi tugmalarni bosib guruh/kanallarga qo'shiling:"
-                ),
-                parse_mode="HTML",
-                reply_markup=keyboard,
-            )
-        except Exception as e:
-            logger.error(f"Failed to send invite to user {user.telegram_id}: {e}")
-            for admin_id in ADMIN_IDS:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"⚠️ Userga ({user.telegram_id}) havola yuborishda xato: {e}",
-                )
+        # Update every admin's message
+        await _mark_decided(query, payment.id, "✅ <b>TASDIQLANDI</b>")
 
     elif action == "reject":
-        payment.status = "rejected"
-        payment.approved_at = datetime.datetime.now()
-        payment.save()
-
-        # Update admin message
-        await query.edit_message_caption(
-            caption=query.message.caption + "\n\n❌ <b>RAD ETILDI</b>",
-            parse_mode="HTML",
-        )
-
-        # Inform user
-        try:
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=(
+        # Inform user (queued with the rejection)
+        notice = outbox.Action(
+            outbox.NOTIFY,
+            user.telegram_id,
+            {
+                "text": (
                     "❌ <b>To'lovingiz rad etildi.</b>\n\n"
                     "Iltimos, to'lov chekini qayta yuboring yoki admin bilan bog'laning.\n"
                     "Qaytadan boshlash uchun /start bosing."
                 ),
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify user {user.telegram_id}: {e}")
+                "parse_mode": "HTML",
+            },
+            f"rejected:{payment.id}",
+        )
+        if not await queries.reject_payment(payment, actions=[notice]):
+            await _already_decided(query, (await queries.get_payment(payment.id)).status)
+            return
+        outbox_dispatcher.wake()
+
+        # Update every admin's message
+        await _mark_decided(query, payment.id, "❌ <b>RAD ETILDI</b>")
 
 
 def get_payment_handler():
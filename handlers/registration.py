@@ -1,6 +1,7 @@
 """Registration handler — welcome menu, subscription flow, status, and support."""
 
 import os
+import asyncio
 import datetime
 import logging
 
@@ -21,7 +22,10 @@ from telegram.ext import (
 )
 
 from config import ADMIN_IDS, MONTHLY_PRICE
-from database import User, Payment, Card, Subscription
+import metrics
+import queries
+from cache import config_cache, subscription_cache, get_active_until, is_active
+from media import media_cache
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +56,7 @@ def _main_menu_keyboard():
 
 # ─── /start — sends welcome image, does NOT enter conversation ──
 
+@metrics.timed("registration.start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Entry point — /start command. Send welcome image with keyboard menu."""
     keyboard = _main_menu_keyboard()
@@ -61,12 +66,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     try:
-        with open(WELCOME_IMAGE, "rb") as photo:
-            await update.message.reply_photo(
-                photo=photo,
-                caption=caption,
-                reply_markup=keyboard,
-            )
+        # Uploaded once, then re-sent by file_id
+        await media_cache.send(
+            update.message.reply_photo,
+            "photo",
+            WELCOME_IMAGE,
+            caption=caption,
+            reply_markup=keyboard,
+        )
     except FileNotFoundError:
         await update.message.reply_text(caption, reply_markup=keyboard)
 
@@ -75,13 +82,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ─── Menu button handlers (standalone, NOT inside ConversationHandler) ──
 
+@metrics.timed("registration.handle_status")
 async def handle_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user's subscription status."""
     telegram_id = update.effective_user.id
 
-    try:
-        user = User.get(User.telegram_id == telegram_id)
-    except User.DoesNotExist:
+    user = await queries.get_user(telegram_id)
+    if user is None:
         await update.message.reply_text(
             "🗂 <b>Obuna holati</b>\n\n"
             "❌ Siz hali ro'yxatdan o'tmagansiz.\n\n"
@@ -90,20 +97,15 @@ async def handle_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    sub = (
-        Subscription.select()
-        .where((Subscription.user == user) & (Subscription.is_active == True))
-        .first()
-    )
-
-    if sub:
-        days_left = (sub.end_date - datetime.datetime.now()).days
+    active_until = await get_active_until(telegram_id)
+    if is_active(active_until):
+        days_left = (active_until - datetime.datetime.now()).days
         text = (
             f"🗂 <b>Obuna holati</b>\n\n"
             f"👤 {user.first_name} {user.last_name}\n"
             f"📱 {user.phone}\n\n"
             f"✅ <b>Obuna faol</b>\n"
-            f"📅 Tugash sanasi: {sub.end_date:%d.%m.%Y}\n"
+            f"📅 Tugash sanasi: {active_until:%d.%m.%Y}\n"
             f"⏳ Qolgan kunlar: <b>{max(days_left, 0)} kun</b>"
         )
     else:
@@ -118,6 +120,7 @@ async def handle_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode="HTML")
 
 
+@metrics.timed("registration.handle_help")
 async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show support contact info."""
     support_contact = os.getenv("SUPPORT_CONTACT", "Admin")
@@ -136,6 +139,7 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ─── Kursga qo'shilish (registration flow — ConversationHandler) ─
 
+@metrics.timed("registration.start_registration")
 async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the course registration flow."""
     await update.message.reply_text(
@@ -147,6 +151,7 @@ async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ASK_FULLNAME
 
 
+@metrics.timed("registration.ask_fullname")
 async def ask_fullname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Save full name, ask for phone number."""
     text = update.message.text.strip()
@@ -165,6 +170,7 @@ async def ask_fullname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASK_PHONE
 
 
+@metrics.timed("registration.ask_phone")
 async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Save phone number, show payment details."""
     if update.message.contact:
@@ -176,18 +182,14 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     price_formatted = f"{MONTHLY_PRICE:,}".replace(",", " ")
 
-    cards = Card.select().where(Card.is_active == True)
-    if not cards:
+    card_text = await config_cache.card_text()
+    if not card_text:
         await update.message.reply_text(
             "⚠️ Hozircha to'lov kartasi qo'shilmagan. Iltimos, keyinroq urinib ko'ring.",
             reply_markup=_main_menu_keyboard(),
         )
         return ConversationHandler.END
 
-    card_text = ""
-    for card in cards:
-        card_text += f"💳 <code>{card.card_number}</code>\n👤 {card.card_holder}\n\n"
-
     await update.message.reply_text(
         f"✅ Ma'lumotlaringiz qabul qilindi!\n\n"
         f"💰 1 oylik obuna narxi: <b>{price_formatted} so'm</b>\n\n"
@@ -199,6 +201,7 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASK_RECEIPT
 
 
+@metrics.timed("registration.ask_receipt")
 async def ask_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Save receipt, forward to admin for approval."""
     if not update.message.photo:
@@ -215,28 +218,9 @@ async def ask_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     last_name = context.user_data["last_name"]
     phone = context.user_data["phone"]
 
-    user, created = User.get_or_create(
-        telegram_id=telegram_id,
-        defaults={
-            "first_name": first_name,
-            "last_name": last_name,
-            "phone": phone,
-            "username": username or "",
-        },
-    )
-    if not created:
-        user.first_name = first_name
-        user.last_name = last_name
-        user.phone = phone
-        user.username = username or ""
-        user.save()
-
-    payment = Payment.create(
-        user=user,
-        amount=MONTHLY_PRICE,
-        receipt_file_id=file_id,
-        status="pending",
-    )
+    user = await queries.save_user(telegram_id, first_name, last_name, phone, username or "")
+    subscription_cache.invalidate(telegram_id)
+    payment = await queries.create_payment(user, MONTHLY_PRICE, file_id)
 
     price_formatted = f"{MONTHLY_PRICE:,}".replace(",", " ")
     admin_text = (
@@ -262,17 +246,28 @@ async def ask_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
     )
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_photo(
+    # Send to every admin at once; each copy is recorded so that all of them
+    # can be updated when one admin decides
+    results = await asyncio.gather(
+        *(
+            context.bot.send_photo(
                 chat_id=admin_id,
                 photo=file_id,
                 caption=admin_text,
                 parse_mode="HTML",
                 reply_markup=keyboard,
             )
-        except Exception as e:
-            logger.error(f"Failed to send receipt to admin {admin_id}: {e}")
+            for admin_id in ADMIN_IDS
+        ),
+        return_exceptions=True,
+    )
+    sent = {}
+    for admin_id, result in zip(ADMIN_IDS, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to send receipt to admin {admin_id}: {result}")
+        else:
+            sent[admin_id] = result.message_id
+    await queries.save_admin_messages(payment.id, sent)
 
     await update.message.reply_text(
         "✅ Chek qabul qilindi!\n\n"
@@ -284,6 +279,7 @@ async def ask_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ─── Cancel ──────────────────────────────────────────────────────
 
+@metrics.timed("registration.cancel")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the conversation."""
     await update.message.reply_text(
@@ -321,6 +317,8 @@ def get_registration_handler():
         },
         fallbacks=[CommandHandler("cancel", cancel), CommandHandler("start", start)],
         allow_reentry=True,
+        name="registration",
+        persistent=True,
     )
 
     # Standalone handlers for menu buttons (NOT inside ConversationHandler)
@@ -0,0 +1,214 @@
+"""Leader lease — lets several bot instances share one database safely.
+
+Every instance handles updates and drains the outbox (claims are already
+safe to share), but only the holder of the "scheduler" lease runs the
+scheduled jobs and the expiry timers. The holder renews the lease every
+LEADER_HEARTBEAT_SECONDS; if it stops (crash, lost database), another
+instance takes over once LEADER_LEASE_SECONDS have passed. A clean shutdown
+releases the lease so failover is immediate.
+
+Each takeover increments the lease's fencing token. Writes made on behalf of
+the leader pass `fence()` to the query, which checks the holder and token
+inside its transaction, so an old leader that stalled past its lease cannot
+write after someone else took over. Takeovers are conditional UPDATEs on the
+token read, so of instances racing for an expired lease only one wins, also
+on databases without SQLite's single writer. Instances compare expiry times
+using their own clocks, which must agree to within a few seconds.
+"""
+
+import asyncio
+import datetime
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+
+from peewee import IntegrityError
+
+from database import db_task, write_transaction, Lease
+from config import LEADER_LEASE_SECONDS, LEADER_HEARTBEAT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """The lease is no longer held by this instance."""
+
+
+def check_fence(fence):
+    """Raise LeaseLost unless `fence` (name, holder, token) is still the current lease.
+
+    Call inside the write transaction it protects; the check is itself a
+    write, so it is serialized with any takeover.
+    """
+    if fence is None:
+        return
+    name, holder, token = fence
+    now = datetime.datetime.now()
+    held = (
+        Lease.update(heartbeat_at=Lease.heartbeat_at)
+        .where(
+            (Lease.name == name) & (Lease.holder == holder) & (Lease.token == token) & (Lease.expires_at > now)
+        )
+        .execute()
+    )
+    if not held:
+        raise LeaseLost(f"Lease {name} token {token} is no longer held")
+
+
+@db_task
+def _acquire(name: str, holder: str, ttl: float):
+    """Take or renew the lease; returns its token, or None if someone else holds it."""
+    now = datetime.datetime.now()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    try:
+        with write_transaction():
+            lease = Lease.get_or_none(Lease.name == name)
+            if lease is None:
+                Lease.create(name=name, holder=holder, token=1, expires_at=expires_at, heartbeat_at=now)
+                return 1
+            if lease.holder != holder and lease.expires_at > now:
+                return None
+            token = lease.token if lease.holder == holder else lease.token + 1
+            # Changes nothing if another instance renewed or took over since the read
+            updated = Lease.update(holder=holder, token=token, expires_at=expires_at, heartbeat_at=now).where(
+                (Lease.name == name) & (Lease.holder == lease.holder) & (Lease.token == lease.token)
+            ).execute()
+            return token if updated else None
+    except IntegrityError:
+        # Another instance created the lease first
+        return None
+
+
+@db_task
+def _release(name: str, holder: str, token: int):
+    now = datetime.datetime.now()
+    with write_transaction():
+        Lease.update(expires_at=now).where(
+            (Lease.name == name) & (Lease.holder == holder) & (Lease.token == token)
+        ).execute()
+
+
+class LeaderLease:
+    def __init__(
+        self, name: str, ttl: float = LEADER_LEASE_SECONDS, heartbeat: float = LEADER_HEARTBEAT_SECONDS
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.token = None
+        self._valid_until = 0.0
+        self._on_elected = None
+        self._on_demoted = None
+        self._elected = None
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        # Stop acting as leader before the lease can expire in the database
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    @property
+    def may_run(self) -> bool:
+        """True if this instance should run leader work (always, while leases are not in use)."""
+        return self._task is None or self.is_leader
+
+    def fence(self):
+        """Fencing value for leader-only writes; None while leases are not in use.
+
+        Raises LeaseLost if this instance is not the leader.
+        """
+        if self._task is None:
+            return None
+        if not self.is_leader:
+            raise LeaseLost(f"Not the holder of lease {self.name}")
+        return (self.name, self.holder, self.token)
+
+    async def start(self, on_elected=None, on_demoted=None):
+        """Start heartbeating; `on_elected()` / `on_demoted()` are called on changes.
+
+        `on_elected()` runs as a task so a slow start (e.g. loading timers)
+        never delays the heartbeat; it is cancelled if the lease is lost first.
+        """
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        await self._beat()
+        self._task = asyncio.create_task(self._run(), name=f"lease_{self.name}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.token is not None:
+            token = self.token
+            await self._demote()
+            try:
+                await _release(self.name, self.holder, token)
+            except Exception as e:
+                logger.error(f"Failed to release lease {self.name}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await self._beat()
+
+    async def _beat(self):
+        started = time.monotonic()
+        try:
+            token = await _acquire(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error(f"Lease {self.name} heartbeat failed: {e}")
+            if self.token is not None and not self.is_leader:
+                await self._demote()
+            return
+
+        if token is None:
+            if self.token is not None:
+                await self._demote()
+            return
+        if self.token is not None and self.token != token:
+            # Lost and taken back in between: end the old term before the new one
+            await self._demote()
+        # Measured from before the query, so it never outlasts the stored lease
+        self._valid_until = started + self.ttl
+        if self.token != token:
+            self.token = token
+            logger.info(f"Elected holder of lease {self.name} (token {token})")
+            if self._on_elected is not None:
+                self._elected = asyncio.create_task(self._on_elected(), name=f"elected_{self.name}")
+
+    async def _demote(self):
+        logger.warning(f"Gave up lease {self.name} (token {self.token})")
+        self.token = None
+        if self._elected is not None:
+            self._elected.cancel()
+            await asyncio.gather(self._elected, return_exceptions=True)
+            self._elected = None
+        if self._on_demoted is not None:
+            await self._on_demoted()
+
+
+scheduler_lease = LeaderLease("scheduler")
+
+
+def leader_only(job):
+    """Wrap a job callback so only the scheduler lease holder runs it."""
+    @functools.wraps(job)
+    async def wrapper(context):
+        if not scheduler_lease.may_run:
+            logger.info(f"Skipping {job.__name__}: not the leader")
+            return
+        try:
+            return await job(context)
+        except LeaseLost as e:
+            logger.warning(f"{job.__name__} stopped: {e}")
+
+    return wrapper
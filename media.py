@@ -0,0 +1,101 @@
+"""Media cache — upload each static file once, then send it by file_id.
+
+A file is identified by the SHA-256 of its contents, so editing it on disk
+makes the next send upload the new version. The hash is only recomputed when
+the file's size or modification time changes. file_ids are stored in the
+media_asset table and survive restarts; one Telegram no longer accepts (e.g.
+after a bot token change) is dropped and the file uploaded again.
+
+    await media_cache.send(update.message.reply_photo, "photo", WELCOME_IMAGE, caption=...)
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+
+from telegram.error import BadRequest
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sent_file_id(message, kind: str) -> str:
+    media = getattr(message, kind)
+    if kind == "photo":
+        media = media[-1]  # largest size
+    return media.file_id
+
+
+class MediaCache:
+    def __init__(self):
+        # path -> (size, mtime_ns, sha256)
+        self._hashes = {}
+        # (sha256, kind) -> file_id
+        self._file_ids = {}
+        # (sha256, kind) -> lock held while uploading
+        self._uploads = {}
+
+    async def _digest(self, path: str) -> str:
+        """SHA-256 of the file; raises FileNotFoundError if it is missing."""
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        sha256 = await asyncio.to_thread(_hash_file, path)
+        self._hashes[path] = (stat.st_size, stat.st_mtime_ns, sha256)
+        return sha256
+
+    async def _file_id(self, key: tuple):
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = await queries.get_media_file_id(*key)
+            if file_id is not None:
+                self._file_ids[key] = file_id
+        return file_id
+
+    async def _forget(self, key: tuple):
+        self._file_ids.pop(key, None)
+        await queries.save_media_file_id(*key, None)
+
+    async def send(self, method, kind: str, path: str, **kwargs):
+        """Call `method` (e.g. reply_photo) with the file as its `kind` argument.
+
+        Returns the sent Message. Concurrent first sends of a file share one
+        upload: the others wait for it and then send its file_id.
+        """
+        key = (await self._digest(path), kind)
+
+        file_id = await self._file_id(key)
+        if file_id is not None:
+            try:
+                return await method(**{kind: file_id}, **kwargs)
+            except BadRequest as e:
+                logger.warning(f"Cached file_id of {path} rejected, uploading again: {e}")
+                await self._forget(key)
+
+        lock = self._uploads.setdefault(key, asyncio.Lock())
+        async with lock:
+            file_id = await self._file_id(key)
+            if file_id is not None:
+                return await method(**{kind: file_id}, **kwargs)
+
+            with open(path, "rb") as f:
+                message = await method(**{kind: f}, **kwargs)
+            file_id = _sent_file_id(message, kind)
+            await queries.save_media_file_id(*key, file_id)
+            self._file_ids[key] = file_id
+            logger.info(f"Uploaded {path}, cached as {file_id}")
+            return message
+
+
+media_cache = MediaCache()
@@ -0,0 +1,278 @@
+"""Metrics — in-process counters and latency histograms, served as Prometheus text.
+
+Recording is a bisect plus a few integer increments under a lock, cheap
+enough for every handler call, query and Bot API request. Histograms are
+also observed from the DB worker threads, hence the lock. `MetricsServer`
+serves GET /metrics from the bot's event loop.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _label_text(self.labels + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Collected:
+    """A counter or gauge read from its owner at scrape time.
+
+    `collect()` returns {label values: value}; it is called on the event
+    loop, so it may read state that is only used there.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labels: tuple, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = labels
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {value}")
+        return lines
+
+
+handler_seconds = Histogram("bot_handler_seconds", "Handler latency.", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Handlers that raised.", ("handler",))
+db_query_seconds = Histogram("bot_db_query_seconds", "DB call duration on the worker thread.", ("query",))
+update_db_queries = Histogram(
+    "bot_update_db_queries", "DB calls made while handling one update.", buckets=COUNT_BUCKETS
+)
+update_db_seconds = Histogram("bot_update_db_seconds", "Time one update spent awaiting DB calls.")
+api_seconds = Histogram("bot_api_request_seconds", "Bot API request latency.", ("method",))
+api_requests = Counter("bot_api_requests_total", "Bot API requests by HTTP status.", ("method", "code"))
+job_seconds = Histogram("bot_job_seconds", "Background job run duration.", ("job",), buckets=JOB_BUCKETS)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Handlers & jobs ────────────────────────────────────────────
+
+def timed(name):
+    """Decorator: record an async handler's latency under `name`.
+
+    `name` may also be a function of the handler's arguments returning the
+    label, e.g. to split one callback handler by button.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            label = name(*args, **kwargs) if callable(name) else name
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(label)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - start, label)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_job(name: str):
+    """Decorator: record a background job's run duration under `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                job_seconds.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+# ─── DB calls per update ────────────────────────────────────────
+# Set by the update processor for the duration of one update; run_db adds
+# every call awaited in that context.
+
+_update_db = contextvars.ContextVar("update_db", default=None)
+
+
+def begin_update():
+    return _update_db.set([0, 0.0])
+
+
+def end_update(token):
+    calls, seconds = _update_db.get()
+    _update_db.reset(token)
+    update_db_queries.observe(calls)
+    update_db_seconds.observe(seconds)
+
+
+def record_db_wait(seconds: float):
+    current = _update_db.get()
+    if current is not None:
+        current[0] += 1
+        current[1] += seconds
+
+
+# ─── Bot API ────────────────────────────────────────────────────
+
+class InstrumentedRequest(BaseRequest):
+    """Wraps a request backend, timing every Bot API call by method and status."""
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        code = "error"
+        start = time.perf_counter()
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+            return code, payload
+        finally:
+            api_seconds.observe(time.perf_counter() - start, api_method)
+            api_requests.inc(api_method, code)
+
+
+# ─── HTTP endpoint ──────────────────────────────────────────────
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics with the Prometheus text format."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics served on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Skip the headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
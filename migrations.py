@@ -0,0 +1,131 @@
+"""Versioned schema migrations — applied to the live database at startup.
+
+Each migration is a (version, description, function) entry in MIGRATIONS.
+Applied versions are recorded in the `schema_version` table, so a migration
+runs exactly once per database. Append new entries; never edit old ones.
+A brand-new database is created straight from the current models and
+stamped with the latest version.
+"""
+
+import datetime
+import logging
+
+from peewee import IntegerField, CharField, DateTimeField, fn
+from playhouse.migrate import SchemaMigrator, migrate
+
+import stats
+from database import (
+    db, BaseModel, User, Card, Channel, Payment, Subscription, StatCounter, InviteLink, Outbox,
+    UserState, ConversationState, ChannelMember, MediaAsset, AdminMessage, Lease,
+    ArchivedPayment, ArchivedSubscription,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField(primary_key=True)
+    description = CharField()
+    applied_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "schema_version"
+
+
+# ─── Migrations ─────────────────────────────────────────────────
+
+def _initial_tables(migrator):
+    db.create_tables([User, Card, Channel, Payment, Subscription], safe=True)
+
+
+def _hot_path_indexes(migrator):
+    # Indexes are declared on the models; create the ones an older bot.db lacks
+    for model in (Payment, Subscription):
+        model._schema.create_indexes(safe=True)
+
+
+# Every model of the current schema, used to create a fresh database
+MODELS = [
+    User, Card, Channel, Payment, Subscription, StatCounter, InviteLink, Outbox,
+    UserState, ConversationState, ChannelMember, MediaAsset, AdminMessage, Lease,
+    ArchivedPayment, ArchivedSubscription,
+]
+
+def _stat_counters(migrator):
+    db.create_tables([StatCounter])
+    stats.reconcile()
+
+
+def _invite_links(migrator):
+    db.create_tables([InviteLink])
+
+
+def _outbox(migrator):
+    db.create_tables([Outbox])
+
+
+def _persistence(migrator):
+    db.create_tables([UserState, ConversationState])
+
+
+def _channel_members(migrator):
+    migrate(migrator.add_column("channel", "members_synced_at", Channel.members_synced_at))
+    db.create_tables([ChannelMember])
+
+
+def _media_assets(migrator):
+    db.create_tables([MediaAsset])
+
+
+def _admin_messages(migrator):
+    db.create_tables([AdminMessage])
+
+
+def _leases(migrator):
+    db.create_tables([Lease])
+
+
+def _archive_tables(migrator):
+    db.create_tables([ArchivedPayment, ArchivedSubscription])
+
+
+MIGRATIONS = [
+    (1, "initial tables", _initial_tables),
+    (2, "hot-path indexes on payment and subscription", _hot_path_indexes),
+    (3, "statistics counters", _stat_counters),
+    (4, "per-user invite links", _invite_links),
+    (5, "outbox of Telegram actions", _outbox),
+    (6, "persisted user_data and conversation states", _persistence),
+    (7, "channel membership", _channel_members),
+    (8, "uploaded media file_ids", _media_assets),
+    (9, "admin copies of payment receipts", _admin_messages),
+    (10, "leader lease", _leases),
+    (11, "archive of old payments and subscriptions", _archive_tables),
+]
+
+
+# ─── Runner ─────────────────────────────────────────────────────
+
+def run_migrations():
+    """Bring the database schema up to the latest version."""
+    with db.connection_context():
+        db.create_tables([SchemaVersion], safe=True)
+        current = SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar() or 0
+        migrator = SchemaMigrator.from_database(db)
+
+        if current == 0 and not db.table_exists(User._meta.table_name):
+            with db.atomic():
+                db.create_tables(MODELS)
+                SchemaVersion.insert_many(
+                    [{"version": v, "description": d} for v, d, _ in MIGRATIONS]
+                ).execute()
+            logger.info(f"Created fresh database at schema version {MIGRATIONS[-1][0]}")
+            return
+
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            with db.atomic():
+                apply(migrator)
+                SchemaVersion.create(version=version, description=description)
+            logger.info(f"Applied migration {version}: {description}")
@@ -0,0 +1,99 @@
+"""Outbox — durable queue of outgoing Telegram actions.
+
+State changes that must reach Telegram (warn, kick, notify, invite) call
+`enqueue()` inside the same transaction as the change, so a crash can never
+commit one without the other. The dispatcher (dispatcher.py) claims due rows,
+performs them and marks them done or schedules a retry with back-off.
+
+Claiming pushes `next_attempt_at` forward by a lease instead of locking rows:
+if the process dies mid-action, the row simply becomes due again. Delivery is
+therefore at-least-once; the unique idempotency key keeps the same action
+from being queued twice.
+"""
+
+import datetime
+import json
+from collections import namedtuple
+
+from database import db_task, write_transaction, Outbox
+from config import OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_KEEP_DAYS
+
+WARN = "warn"
+NOTIFY = "notify"
+KICK = "kick"
+INVITE = "invite"
+
+Action = namedtuple("Action", "action chat_id payload key")
+
+
+def enqueue(action: Action):
+    """Queue an action. Call inside the transaction of the change that causes it."""
+    Outbox.insert(
+        action=action.action,
+        chat_id=action.chat_id,
+        payload=json.dumps(action.payload),
+        idempotency_key=action.key,
+    ).on_conflict_ignore().execute()
+
+
+def backoff(attempts: int) -> datetime.timedelta:
+    """Delay before retry number `attempts` (exponential, capped at an hour)."""
+    return datetime.timedelta(seconds=min(5 * 2 ** (attempts - 1), 3600))
+
+
+@db_task
+def claim(limit: int) -> list:
+    """Lease up to `limit` due actions, oldest first."""
+    now = datetime.datetime.now()
+    due = (
+        Outbox.select(Outbox.id)
+        .where((Outbox.status == "pending") & (Outbox.next_attempt_at <= now))
+        .order_by(Outbox.next_attempt_at, Outbox.id)
+        .limit(limit)
+    )
+    with write_transaction():
+        rows = list(
+            Outbox.update(
+                attempts=Outbox.attempts + 1,
+                next_attempt_at=now + datetime.timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                updated_at=now,
+            )
+            # Re-checked on the rows themselves: a concurrent claim may have
+            # taken them between the subquery and the update
+            .where(Outbox.id.in_(due) & (Outbox.status == "pending") & (Outbox.next_attempt_at <= now))
+            .returning(Outbox)
+            .objects()
+            .execute()
+        )
+    rows.sort(key=lambda row: row.id)
+    return rows
+
+
+@db_task
+def complete(outbox_id: int):
+    Outbox.update(status="done", last_error=None, updated_at=datetime.datetime.now()).where(
+        Outbox.id == outbox_id
+    ).execute()
+
+
+@db_task
+def fail(row, error: str, permanent: bool = False) -> bool:
+    """Record a failed attempt; returns True if the action was given up on."""
+    now = datetime.datetime.now()
+    give_up = permanent or row.attempts >= OUTBOX_MAX_ATTEMPTS
+    Outbox.update(
+        status="failed" if give_up else "pending",
+        next_attempt_at=now if give_up else now + backoff(row.attempts),
+        last_error=error[:1000],
+        updated_at=now,
+    ).where(Outbox.id == row.id).execute()
+    return give_up
+
+
+@db_task
+def purge_done(days: int = OUTBOX_KEEP_DAYS) -> int:
+    """Delete completed actions older than `days`; returns rows deleted."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    with write_transaction():
+        return Outbox.delete().where((Outbox.status == "done") & (Outbox.updated_at < cutoff)).execute()
+
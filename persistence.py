@@ -0,0 +1,174 @@
+"""Persistence — conversation states and user_data kept in bot.db across restarts.
+
+Nothing is read at startup except the states of unfinished conversations: a
+user's user_data is loaded the first time one of their updates is handled.
+PTB hands us every touched user each PERSISTENCE_FLUSH_INTERVAL seconds; only
+rows whose JSON actually changed (compared by hash) are written, all in one
+transaction.
+Changes that arrive during a write follow in another; a failed write is
+retried every interval until it succeeds.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import queries
+from config import PERSISTENCE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def _digest(serialized: str) -> bytes:
+    return hashlib.blake2b(serialized.encode(), digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data and conversations in the user_state / conversation_state tables.
+
+    chat_data, bot_data and callback_data are not used by the bot and not stored.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded = set()
+        # user_id -> digest of the JSON as last read or written, to skip unchanged data
+        self._saved = {}
+        # Rows waiting for the next write; a None value deletes the row
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._write_task = None
+        self._retrying = False
+
+    # ─── user_data ──────────────────────────────────────────────
+
+    async def get_user_data(self):
+        # Loaded per user in refresh_user_data instead
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._loaded:
+            return
+        stored = await queries.get_user_state(user_id)
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        if stored is not None:
+            self._saved[user_id] = _digest(stored)
+            for key, value in json.loads(stored).items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        try:
+            serialized = _dumps(data) if data else None
+        except (TypeError, ValueError) as e:
+            logger.error(f"user_data of {user_id} is not JSON-serializable, not saved: {e}")
+            return
+        if (serialized and _digest(serialized)) == self._saved.get(user_id):
+            self._pending_users.pop(user_id, None)
+            return
+        self._pending_users[user_id] = serialized
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        self._loaded.discard(user_id)
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    # ─── Conversations ──────────────────────────────────────────
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await queries.get_conversation_states(name)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        state = _dumps(new_state) if new_state is not None else None
+        self._pending_conversations[(name, _dumps(list(key)))] = state
+        self._schedule_write()
+
+    # ─── Writing ────────────────────────────────────────────────
+
+    def _schedule_write(self):
+        # PTB calls update_* for every touched user at once; the first call
+        # starts a write that picks up all of them
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write(), name="persistence_write")
+
+    async def _write(self):
+        await asyncio.sleep(0)
+        # Changes queued while a batch is being written go out in the next one
+        while self._pending_users or self._pending_conversations:
+            if not await self._write_batch():
+                self._retrying = True
+                try:
+                    await asyncio.sleep(self.update_interval)
+                finally:
+                    self._retrying = False
+
+    async def _write_batch(self) -> bool:
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        try:
+            await queries.save_persistence(users, conversations)
+        except Exception as e:
+            logger.error(f"Persistence write failed, retrying in {self.update_interval:.0f}s: {e}")
+            for user_id, data in users.items():
+                self._pending_users.setdefault(user_id, data)
+            for key, state in conversations.items():
+                self._pending_conversations.setdefault(key, state)
+            return False
+        for user_id, data in users.items():
+            if data is None:
+                self._saved.pop(user_id, None)
+            else:
+                self._saved[user_id] = _digest(data)
+        return True
+
+    async def flush(self):
+        task = self._write_task
+        if task is not None and not task.done():
+            # Don't wait out a retry delay; try once more below
+            if self._retrying:
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self._pending_users or self._pending_conversations:
+            await self._write_batch()
+
+    # ─── Not stored ─────────────────────────────────────────────
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
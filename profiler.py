@@ -0,0 +1,160 @@
+"""On-demand profiling of the live bot, started by an admin with /profile.
+
+cProfile is enabled on the event-loop thread, so everything the loop runs
+while a session is open is recorded: update handlers, the subscription check,
+expiry timers and the outbox dispatcher (DB queries show up as time awaiting
+the worker pool). A session ends after N updates or T seconds; the admin then
+receives a ranked report and the raw .prof file for snakeviz / pstats.
+
+While no session is open the only cost is one `is None` check per update.
+"""
+
+import asyncio
+import cProfile
+import datetime
+import html
+import io
+import logging
+import os
+import pstats
+import tempfile
+import time
+
+from telegram import InputFile
+
+logger = logging.getLogger(__name__)
+
+REPORT_ROWS = 25
+
+
+class ProfileSession:
+    def __init__(self, bot, chat_id: int, max_updates: int, max_seconds: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.max_updates = max_updates
+        self.max_seconds = max_seconds
+        self.updates = 0
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.timer = None
+
+
+class Profiler:
+    def __init__(self):
+        self.session = None
+        self._reports = set()
+
+    def start(self, bot, chat_id: int, max_updates: int, max_seconds: float) -> bool:
+        """Open a session; returns False if one is already running."""
+        if self.session is not None:
+            return False
+        session = ProfileSession(bot, chat_id, max_updates, max_seconds)
+        session.timer = asyncio.get_running_loop().call_later(max_seconds, self.finish)
+        try:
+            session.profile.enable()
+        except ValueError as e:  # another profiler owns the thread
+            session.timer.cancel()
+            logger.error(f"Cannot start profiling: {e}")
+            return False
+        self.session = session
+        logger.info(f"Profiling started: {max_updates} updates or {max_seconds:.0f}s")
+        return True
+
+    def update_done(self):
+        """Count a handled update; ends the session once it has seen enough."""
+        session = self.session
+        session.updates += 1
+        if session.max_updates and session.updates >= session.max_updates:
+            self.finish()
+
+    def finish(self):
+        """Stop profiling and send the report in the background."""
+        session = self.session
+        if session is None:
+            return
+        session.profile.disable()
+        session.timer.cancel()
+        self.session = None
+        task = asyncio.get_running_loop().create_task(_send_report(session))
+        self._reports.add(task)
+        task.add_done_callback(self._reports.discard)
+
+    async def run(self, bot, chat_id: int, coroutine):
+        """Profile one awaited job (e.g. the subscription check) on its own."""
+        if not self.start(bot, chat_id, max_updates=0, max_seconds=24 * 3600):
+            coroutine.close()
+            return False
+        try:
+            await coroutine
+        finally:
+            self.finish()
+        return True
+
+
+profiler = Profiler()
+
+
+# ─── Report ─────────────────────────────────────────────────────
+
+def _location(key) -> str:
+    filename, line, func = key
+    if filename == "~":
+        return func  # built-in
+    return f"{os.path.basename(filename)}:{line}({func})"
+
+
+def _is_idle(key) -> bool:
+    # The event loop waiting in select/epoll for I/O
+    return key[0] == "~" and "of 'select." in key[2]
+
+
+def render_report(stats: pstats.Stats, rows: int = REPORT_ROWS) -> tuple:
+    """Top functions by own time, with call counts and cumulative time.
+
+    Returns (report, seconds the loop sat idle waiting for I/O); the idle
+    wait is left out of the ranking.
+    """
+    idle = sum(entry[2] for key, entry in stats.stats.items() if _is_idle(key))
+    entries = sorted(
+        (item for item in stats.stats.items() if not _is_idle(item[0])),
+        key=lambda item: item[1][2],
+        reverse=True,
+    )[:rows]
+    lines = [f"{'calls':>8} {'own s':>8} {'cum s':>8}  function"]
+    for key, (_, calls, own, cumulative, _) in entries:
+        lines.append(f"{calls:>8} {own:>8.3f} {cumulative:>8.3f}  {_location(key)}")
+    return "\n".join(lines), idle
+
+
+async def _send_report(session: ProfileSession):
+    elapsed = time.perf_counter() - session.started
+    stats = pstats.Stats(session.profile, stream=io.StringIO())
+    report, idle = render_report(stats)
+    header = (
+        f"🔬 <b>Profil tayyor</b>\n\n"
+        f"⏱ {elapsed:.1f} s, {session.updates} ta update\n"
+        f"⚙️ Band: {stats.total_tt - idle:.3f} s, bo'sh (I/O kutish): {idle:.3f} s\n\n"
+    )
+    # Telegram messages are capped at 4096 characters; drop whole rows
+    lines = html.escape(report, quote=False).split("\n")
+    while len(lines) > 1 and len(header) + sum(len(line) + 1 for line in lines) > 4000:
+        lines.pop()
+    body = "\n".join(lines)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "profile.prof")
+        stats.dump_stats(path)
+        with open(path, "rb") as f:
+            data = f.read()
+
+    filename = f"profile-{datetime.datetime.now():%Y%m%d-%H%M%S}.prof"
+    try:
+        await session.bot.send_message(
+            chat_id=session.chat_id, text=f"{header}<pre>{body}</pre>", parse_mode="HTML"
+        )
+        await session.bot.send_document(
+            chat_id=session.chat_id, document=InputFile(data, filename=filename)
+        )
+    except Exception as e:
+        logger.error(f"Failed to send profile report to {session.chat_id}: {e}")
+    logger.info(f"Profiling finished after {elapsed:.1f}s and {session.updates} updates")
@@ -0,0 +1,577 @@
+"""Data-access layer — every query the handlers and the scheduler await.
+
+Each function runs on the DB pool (see `database.db_task`), so models returned
+from here have their related rows joined in and never lazy-load on the event loop.
+"""
+
+import datetime
+
+from peewee import JOIN, Tuple, chunked, fn
+
+import leader
+import outbox
+import stats
+from database import (
+    db_task, write_transaction, User, Card, Channel, Payment, Subscription, InviteLink,
+    UserState, ConversationState, ChannelMember, MediaAsset, AdminMessage, ArchivedPayment,
+)
+
+
+# ─── Users & subscriptions ──────────────────────────────────────
+
+# Subscription status of a telegram_id that has no User row
+UNREGISTERED = "unregistered"
+
+
+@db_task
+def get_user(telegram_id: int):
+    """Return the User or None."""
+    return User.get_or_none(User.telegram_id == telegram_id)
+
+
+@db_task
+def get_subscription_status(telegram_id: int):
+    """Latest end date of the user's active subscriptions, None if there is none,
+    or UNREGISTERED if the user does not exist — in one query."""
+    row = (
+        User.select(User.id, fn.MAX(Subscription.end_date).alias("active_until"))
+        .join(
+            Subscription,
+            JOIN.LEFT_OUTER,
+            on=((Subscription.user == User.id) & (Subscription.is_active == True)),
+        )
+        .where(User.telegram_id == telegram_id)
+        .group_by(User.id)
+        .dicts()
+        .first()
+    )
+    if row is None:
+        return UNREGISTERED
+    return Subscription.end_date.python_value(row["active_until"])
+
+
+@db_task
+def get_active_subscription_ends(limit: int):
+    """(telegram_id, latest end date) for users with an active subscription."""
+    rows = (
+        Subscription.select(User.telegram_id, fn.MAX(Subscription.end_date))
+        .join(User)
+        .where(Subscription.is_active == True)
+        .group_by(User.telegram_id)
+        .limit(limit)
+        .tuples()
+    )
+    return [(telegram_id, Subscription.end_date.python_value(end)) for telegram_id, end in rows]
+
+
+@db_task
+def save_user(telegram_id: int, first_name: str, last_name: str, phone: str, username: str):
+    """Create or update the user from registration data."""
+    with write_transaction():
+        user, created = User.get_or_create(
+            telegram_id=telegram_id,
+            defaults={
+                "first_name": first_name,
+                "last_name": last_name,
+                "phone": phone,
+                "username": username,
+            },
+        )
+        if created:
+            stats.bump(stats.USERS)
+    if not created:
+        user.first_name = first_name
+        user.last_name = last_name
+        user.phone = phone
+        user.username = username
+        user.save()
+    return user
+
+
+@db_task
+def get_expiring_subscriptions(now: datetime.datetime, threshold: datetime.datetime, after_id: int, limit: int):
+    """Next chunk (by id) of active, not yet warned subscriptions ending in (now, threshold]."""
+    return list(
+        Subscription.select(Subscription, User)
+        .join(User)
+        .where(
+            (Subscription.is_active == True)
+            & (Subscription.warning_sent == False)
+            & (Subscription.end_date <= threshold)
+            & (Subscription.end_date > now)
+            & (Subscription.id > after_id)
+        )
+        .order_by(Subscription.id)
+        .limit(limit)
+    )
+
+
+@db_task
+def get_expired_subscriptions(now: datetime.datetime, after_id: int, limit: int):
+    """Next chunk (by id) of active subscriptions whose end date has passed."""
+    return list(
+        Subscription.select(Subscription, User)
+        .join(User)
+        .where(
+            (Subscription.is_active == True)
+            & (Subscription.end_date <= now)
+            & (Subscription.id > after_id)
+        )
+        .order_by(Subscription.id)
+        .limit(limit)
+    )
+
+
+@db_task
+def mark_warning_sent(sub_ids: list, actions: dict = None, fence=None) -> list:
+    """Set warning_sent on the given subscriptions in one UPDATE.
+
+    `actions` maps subscription id -> outbox actions queued in the same
+    transaction for every subscription this call flagged. Returns those ids.
+    With a `fence` (see leader.py) nothing is written unless the lease is held.
+    """
+    if not sub_ids:
+        return []
+    with write_transaction():
+        leader.check_fence(fence)
+        rows = (
+            Subscription.update(warning_sent=True)
+            .where(Subscription.id.in_(sub_ids) & (Subscription.warning_sent == False))
+            .returning(Subscription.id)
+            .tuples()
+            .execute()
+        )
+        changed = [sub_id for (sub_id,) in rows]
+        _enqueue_for(changed, actions)
+    return changed
+
+
+@db_task
+def deactivate_subscriptions(sub_ids: list, actions: dict = None, fence=None) -> list:
+    """Deactivate the given subscriptions in one UPDATE.
+
+    Returns the ids this call actually deactivated, so concurrent callers
+    (expiry timers and the daily scan) never both act on the same row.
+    `actions` maps subscription id -> outbox actions (kicks, notification)
+    queued in the same transaction for each of those ids. With a `fence`
+    (see leader.py) nothing is written unless the lease is held.
+    """
+    if not sub_ids:
+        return []
+    with write_transaction():
+        leader.check_fence(fence)
+        rows = (
+            Subscription.update(is_active=False)
+            .where(Subscription.id.in_(sub_ids) & (Subscription.is_active == True))
+            .returning(Subscription.id)
+            .tuples()
+            .execute()
+        )
+        changed = [sub_id for (sub_id,) in rows]
+        stats.bump(stats.ACTIVE_SUBSCRIPTIONS, -len(changed))
+        _enqueue_for(changed, actions)
+    return changed
+
+
+def _enqueue_for(sub_ids: list, actions: dict):
+    if actions:
+        for sub_id in sub_ids:
+            for action in actions.get(sub_id, ()):
+                outbox.enqueue(action)
+
+
+@db_task
+def get_subscriptions(sub_ids: list) -> list:
+    """Subscriptions by id with their users joined."""
+    if not sub_ids:
+        return []
+    return list(
+        Subscription.select(Subscription, User)
+        .join(User)
+        .where(Subscription.id.in_(sub_ids))
+    )
+
+
+@db_task
+def get_active_subscription_timers(after_id: int, limit: int) -> list:
+    """Next chunk (by id) of (id, end_date, warning_sent) for active subscriptions."""
+    return list(
+        Subscription.select(Subscription.id, Subscription.end_date, Subscription.warning_sent)
+        .where((Subscription.is_active == True) & (Subscription.id > after_id))
+        .order_by(Subscription.id)
+        .limit(limit)
+        .tuples()
+    )
+
+
+# ─── Cards & channels ───────────────────────────────────────────
+
+@db_task
+def get_active_cards():
+    return list(Card.select().where(Card.is_active == True))
+
+
+@db_task
+def add_card(card_number: str, card_holder: str):
+    return Card.create(card_number=card_number, card_holder=card_holder, is_active=True)
+
+
+@db_task
+def delete_card(card_id: int) -> bool:
+    """Delete a card; False if it did not exist."""
+    return Card.delete().where(Card.id == card_id).execute() > 0
+
+
+@db_task
+def get_active_channels():
+    return list(Channel.select().where(Channel.is_active == True))
+
+
+@db_task
+def add_channel(chat_id: int, title: str):
+    return Channel.create(chat_id=chat_id, title=title, is_active=True)
+
+
+@db_task
+def delete_channel(channel_id: int) -> bool:
+    """Delete a channel with its invite links and members; False if it did not exist."""
+    with write_transaction():
+        channel = Channel.get_or_none(Channel.id == channel_id)
+        if channel is None:
+            return False
+        InviteLink.delete().where(InviteLink.channel == channel_id).execute()
+        ChannelMember.delete().where(ChannelMember.chat_id == channel.chat_id).execute()
+        channel.delete_instance()
+        return True
+
+
+@db_task
+def get_valid_invite_links(user_id: int) -> dict:
+    """{channel id: invite link} of the user's stored links that have not expired."""
+    now = datetime.datetime.now()
+    rows = InviteLink.select().where((InviteLink.user == user_id) & (InviteLink.expires_at > now))
+    return {row.channel_id: row.invite_link for row in rows}
+
+
+@db_task
+def save_invite_links(user_id: int, links: dict, expires_at=None):
+    """Store freshly created {channel id: invite link} for the user, replacing old ones."""
+    if not links:
+        return
+    rows = [
+        {"user": user_id, "channel": channel_id, "invite_link": link, "expires_at": expires_at}
+        for channel_id, link in links.items()
+    ]
+    with write_transaction():
+        (
+            InviteLink.insert_many(rows)
+            .on_conflict(
+                conflict_target=[InviteLink.user, InviteLink.channel],
+                preserve=[InviteLink.invite_link, InviteLink.expires_at],
+                update={InviteLink.created_at: datetime.datetime.now()},
+            )
+            .execute()
+        )
+
+
+# ─── Channel members ────────────────────────────────────────────
+
+@db_task
+def add_channel_members(chat_id: int, telegram_ids: list):
+    if telegram_ids:
+        ChannelMember.insert_many(
+            [{"chat_id": chat_id, "telegram_id": telegram_id} for telegram_id in telegram_ids]
+        ).on_conflict_ignore().execute()
+
+
+@db_task
+def remove_channel_members(chat_id: int, telegram_ids: list):
+    if telegram_ids:
+        ChannelMember.delete().where(
+            (ChannelMember.chat_id == chat_id) & ChannelMember.telegram_id.in_(telegram_ids)
+        ).execute()
+
+
+@db_task
+def get_channel_memberships(telegram_ids: list) -> set:
+    """(chat_id, telegram_id) of every recorded membership of the given users."""
+    query = ChannelMember.select(ChannelMember.chat_id, ChannelMember.telegram_id)
+    return set(query.where(ChannelMember.telegram_id.in_(telegram_ids)).tuples())
+
+
+@db_task
+def get_unsubscribed_members(chat_id: int, after_telegram_id: int, limit: int) -> list:
+    """Recorded members of a channel without an active subscription, by telegram_id."""
+    active = (
+        Subscription.select(Subscription.id)
+        .join(User)
+        .where((User.telegram_id == ChannelMember.telegram_id) & (Subscription.is_active == True))
+    )
+    query = (
+        ChannelMember.select(ChannelMember.telegram_id)
+        .where(
+            (ChannelMember.chat_id == chat_id)
+            & (ChannelMember.telegram_id > after_telegram_id)
+            & ~fn.EXISTS(active)
+        )
+        .order_by(ChannelMember.telegram_id)
+        .limit(limit)
+    )
+    return [telegram_id for (telegram_id,) in query.tuples()]
+
+
+@db_task
+def get_unrecorded_subscribers(chat_id: int, after_telegram_id: int, limit: int) -> list:
+    """Users with an active subscription not recorded as members of a channel, by telegram_id."""
+    recorded = ChannelMember.select(ChannelMember.telegram_id).where(
+        (ChannelMember.chat_id == chat_id) & (ChannelMember.telegram_id == User.telegram_id)
+    )
+    query = (
+        User.select(User.telegram_id)
+        .join(Subscription)
+        .where(
+            (Subscription.is_active == True)
+            & (User.telegram_id > after_telegram_id)
+            & ~fn.EXISTS(recorded)
+        )
+        .distinct()
+        .order_by(User.telegram_id)
+        .limit(limit)
+    )
+    return [telegram_id for (telegram_id,) in query.tuples()]
+
+
+@db_task
+def mark_members_synced(channel_id: int):
+    Channel.update(members_synced_at=datetime.datetime.now()).where(Channel.id == channel_id).execute()
+
+
+@db_task
+def enqueue_actions(actions: list):
+    with write_transaction():
+        for action in actions:
+            outbox.enqueue(action)
+
+
+# ─── Payments ───────────────────────────────────────────────────
+
+@db_task
+def create_payment(user, amount: int, receipt_file_id: str):
+    with write_transaction():
+        payment = Payment.create(
+            user=user,
+            amount=amount,
+            receipt_file_id=receipt_file_id,
+            status="pending",
+        )
+        stats.move_payment(None, "pending")
+    return payment
+
+
+@db_task
+def save_admin_messages(payment_id: int, messages: dict):
+    """Record {admin_id: message_id} of the receipt copies sent for a payment."""
+    if messages:
+        AdminMessage.insert_many(
+            [{"payment": payment_id, "admin_id": admin_id, "message_id": message_id}
+             for admin_id, message_id in messages.items()]
+        ).on_conflict(
+            conflict_target=[AdminMessage.payment, AdminMessage.admin_id],
+            preserve=[AdminMessage.message_id],
+        ).execute()
+
+
+@db_task
+def get_admin_messages(payment_id: int) -> list:
+    """(admin_id, message_id) of every receipt copy of a payment."""
+    query = AdminMessage.select(AdminMessage.admin_id, AdminMessage.message_id)
+    return list(query.where(AdminMessage.payment == payment_id).tuples())
+
+
+@db_task
+def get_payment(payment_id: int):
+    """Return the payment with its user joined, or None."""
+    return (
+        Payment.select(Payment, User)
+        .join(User)
+        .where(Payment.id == payment_id)
+        .first()
+    )
+
+
+@db_task
+def get_archived_payment(payment_id: int):
+    """Return the archived payment with its user joined, or None."""
+    return (
+        ArchivedPayment.select(ArchivedPayment, User)
+        .join(User)
+        .where(ArchivedPayment.id == payment_id)
+        .first()
+    )
+
+
+@db_task
+def approve_payment(payment, admin_id: int, days: int = 30, actions: list = ()):
+    """Mark the payment approved and open a subscription for `days` days.
+
+    The status moves pending → approved with one conditional UPDATE, so of
+    concurrent decisions exactly one wins; the others get None and change
+    nothing. The subscription and `actions` (the user's invite) are written
+    in the same transaction.
+    """
+    now = datetime.datetime.now()
+    with write_transaction():
+        won = (
+            Payment.update(status="approved", approved_by=admin_id, approved_at=now)
+            .where((Payment.id == payment.id) & (Payment.status == "pending"))
+            .execute()
+        )
+        if not won:
+            return None
+        payment.status = "approved"
+        payment.approved_by = admin_id
+        payment.approved_at = now
+        sub = Subscription.create(
+            user=payment.user,
+            payment=payment,
+            start_date=now,
+            end_date=now + datetime.timedelta(days=days),
+            is_active=True,
+            warning_sent=False,
+        )
+        stats.move_payment("pending", "approved")
+        stats.bump(stats.ACTIVE_SUBSCRIPTIONS)
+        for action in actions:
+            outbox.enqueue(action)
+    return sub
+
+
+@db_task
+def reject_payment(payment, actions: list = ()) -> bool:
+    """Mark a pending payment rejected; False if it was already decided."""
+    now = datetime.datetime.now()
+    with write_transaction():
+        won = (
+            Payment.update(status="rejected", approved_at=now)
+            .where((Payment.id == payment.id) & (Payment.status == "pending"))
+            .execute()
+        )
+        if not won:
+            return False
+        payment.status = "rejected"
+        payment.approved_at = now
+        stats.move_payment("pending", "rejected")
+        for action in actions:
+            outbox.enqueue(action)
+    return True
+
+
+@db_task
+def get_payments_page(status: str, direction: str, cursor: tuple, page_size: int):
+    """Keyset page of payments, newest first, keyed on (created_at, id).
+
+    `direction` is "next" (older than `cursor`), "prev" (newer than `cursor`)
+    or "start" (from `cursor` inclusive); `cursor` is None for the first page.
+    Returns (rows in display order, whether more rows exist in that direction).
+    """
+    key = Tuple(Payment.created_at, Payment.id)
+    query = Payment.select(Payment, User).join(User)
+    if status:
+        query = query.where(Payment.status == status)
+
+    if direction == "prev":
+        query = query.where(key > cursor).order_by(Payment.created_at, Payment.id)
+    else:
+        if cursor is not None:
+            query = query.where(key < cursor if direction == "next" else key <= cursor)
+        query = query.order_by(Payment.created_at.desc(), Payment.id.desc())
+
+    rows = list(query.limit(page_size + 1))
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "prev":
+        rows.reverse()
+    return rows, has_more
+
+
+# ─── Media ──────────────────────────────────────────────────────
+
+@db_task
+def get_media_file_id(sha256: str, kind: str):
+    row = MediaAsset.get_or_none((MediaAsset.sha256 == sha256) & (MediaAsset.kind == kind))
+    return row.file_id if row else None
+
+
+@db_task
+def save_media_file_id(sha256: str, kind: str, file_id):
+    """Store the file_id of an uploaded file; None forgets it."""
+    if file_id is None:
+        MediaAsset.delete().where((MediaAsset.sha256 == sha256) & (MediaAsset.kind == kind)).execute()
+        return
+    MediaAsset.insert(
+        sha256=sha256, kind=kind, file_id=file_id, updated_at=datetime.datetime.now()
+    ).on_conflict(
+        conflict_target=[MediaAsset.sha256, MediaAsset.kind],
+        preserve=[MediaAsset.file_id, MediaAsset.updated_at],
+    ).execute()
+
+
+# ─── Persistence ────────────────────────────────────────────────
+
+PERSISTENCE_CHUNK = 500
+
+
+@db_task
+def get_user_state(user_id: int):
+    """Stored user_data JSON of one user, or None."""
+    row = UserState.get_or_none(UserState.user_id == user_id)
+    return row.data if row else None
+
+
+@db_task
+def get_conversation_states(name: str) -> list:
+    """(key JSON, state JSON) of every unfinished conversation of handler `name`."""
+    query = ConversationState.select(ConversationState.key, ConversationState.state)
+    return list(query.where(ConversationState.name == name).tuples())
+
+
+@db_task
+def save_persistence(user_states: dict, conversations: dict):
+    """Write changed user_data and conversation states in one transaction.
+
+    `user_states` maps user_id and `conversations` maps (name, key) to the new
+    JSON, or to None to delete the row.
+    """
+    now = datetime.datetime.now()
+    with write_transaction():
+        upserts = [
+            {"user_id": user_id, "data": data, "updated_at": now}
+            for user_id, data in user_states.items() if data is not None
+        ]
+        for batch in chunked(upserts, PERSISTENCE_CHUNK):
+            UserState.insert_many(batch).on_conflict(
+                conflict_target=[UserState.user_id],
+                preserve=[UserState.data, UserState.updated_at],
+            ).execute()
+        deletes = [user_id for user_id, data in user_states.items() if data is None]
+        for batch in chunked(deletes, PERSISTENCE_CHUNK):
+            UserState.delete().where(UserState.user_id.in_(batch)).execute()
+
+        upserts = [
+            {"name": name, "key": key, "state": state, "updated_at": now}
+            for (name, key), state in conversations.items() if state is not None
+        ]
+        for batch in chunked(upserts, PERSISTENCE_CHUNK):
+            ConversationState.insert_many(batch).on_conflict(
+                conflict_target=[ConversationState.name, ConversationState.key],
+                preserve=[ConversationState.state, ConversationState.updated_at],
+            ).execute()
+        ended = {}
+        for (name, key), state in conversations.items():
+            if state is None:
+                ended.setdefault(name, []).append(key)
+        for name, keys in ended.items():
+            for batch in chunked(keys, PERSISTENCE_CHUNK):
+                ConversationState.delete().where(
+                    (ConversationState.name == name) & ConversationState.key.in_(batch)
+                ).execute()
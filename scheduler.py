@@ -1,98 +1,307 @@
-"""Scheduler — checks subscription expiry daily, sends warnings, and removes expired users."""
+"""Scheduler — per-subscription expiry timers plus a daily safety-net check.
 
+Every active subscription gets two timers: a warning 3 days before it ends and
+the expiry itself. Timers live in an in-memory heap; they are added when a
+payment is approved and rebuilt from the database on startup. The daily check
+only catches whatever the timers missed. Messages and kicks go through the
+outbox (outbox.py), so they survive a crash between deciding and sending.
+
+With several instances only the scheduler lease holder (leader.py) runs the
+timers and the check; subscriptions approved on other instances are picked
+up from the database every NEW_SUBSCRIPTIONS_POLL seconds.
+"""
+
+import asyncio
 import datetime
+import heapq
+import itertools
 import logging
+import time
 
-from database import Subscription, Channel
+import metrics
+import outbox
+import queries
+from cache import config_cache, subscription_cache
+from channel_members import kick_channels
+from config import SCHEDULER_CHUNK_SIZE
+from dispatcher import outbox_dispatcher
+from leader import scheduler_lease
 
 logger = logging.getLogger(__name__)
 
+WARN_BEFORE = datetime.timedelta(days=3)
+NEW_SUBSCRIPTIONS_POLL = 60
+FIRE_RETRY_DELAY = datetime.timedelta(seconds=30)
 
-async def check_subscriptions(context):
-    """Run daily: warn expiring users and kick expired ones."""
-    now = datetime.datetime.now()
 
-    # ── 1. Send warnings (3 days before expiry) ──
-    warn_threshold = now + datetime.timedelta(days=3)
-    expiring = (
-        Subscription.select()
-        .where(
-            (Subscription.is_active == True)
-            & (Subscription.warning_sent == False)
-            & (Subscription.end_date <= warn_threshold)
-            & (Subscription.end_date > now)
-        )
+# ─── Warn / expire ──────────────────────────────────────────────
+# The messages and kicks are queued in the outbox in the same transaction
+# that flags or deactivates the subscription, and sent by the dispatcher.
+
+def _warning(sub, now) -> outbox.Action:
+    days_left = (sub.end_date - now).days
+    return outbox.Action(
+        outbox.WARN,
+        sub.user.telegram_id,
+        {
+            "text": (
+                f"⚠️ <b>Diqqat!</b>\n\n"
+                f"Obunangiz tugashiga <b>{days_left} kun</b> qoldi.\n\n"
+                f"To'lovni uzaytirish uchun /start bosing."
+            ),
+            "parse_mode": "HTML",
+        },
+        f"warn:{sub.id}",
     )
 
-    for sub in expiring:
-        user = sub.user
-        days_left = (sub.end_date - now).days
-        try:
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=(
-                    f"⚠️ <b>Diqqat!</b>\n\n"
-                    f"Obunangiz tugashiga <b>{days_left} kun</b> qoldi.\n\n"
-                    f"To'lovni uzaytirish uchun /start bosing."
+
+def _removal(sub, channels) -> list:
+    user = sub.user
+    # Kick from the channels the user is in, then notify the user
+    actions = [
+        outbox.Action(outbox.KICK, ch.chat_id, {"user_id": user.telegram_id}, f"kick:{sub.id}:{ch.chat_id}")
+        for ch in channels
+    ]
+    actions.append(
+        outbox.Action(
+            outbox.NOTIFY,
+            user.telegram_id,
+            {
+                "text": (
+                    "❌ <b>Obunangiz tugadi!</b>\n\n"
+                    "Siz guruh/kanallardan chiqarildingiz.\n\n"
+                    "Qayta obuna bo'lish uchun /start bosing."
                 ),
-                parse_mode="HTML",
-            )
-            sub.warning_sent = True
-            sub.save()
-            logger.info(f"Warning sent to user {user.telegram_id}, {days_left} days left")
-        except Exception as e:
-            logger.error(f"Failed to warn user {user.telegram_id}: {e}")
-
-    # ── 2. Remove expired users ──
-    expired = (
-        Subscription.select()
-        .where(
-            (Subscription.is_active == True) & (Subscription.end_date <= now)
+                "parse_mode": "HTML",
+            },
+            f"expired:{sub.id}",
         )
     )
+    return actions
+
+
+async def warn_subscriptions(subs, now) -> int:
+    """Flag a batch of subscriptions as warned and queue the warnings; returns users warned."""
+    actions = {sub.id: [_warning(sub, now)] for sub in subs}
+    warned = await queries.mark_warning_sent(list(actions), actions, fence=scheduler_lease.fence())
+    if warned:
+        outbox_dispatcher.wake()
+    return len(warned)
+
+
+async def expire_subscriptions(subs) -> int:
+    """Deactivate a batch of subscriptions and queue their kicks; returns subscriptions expired.
 
-    channels = Channel.select().where(Channel.is_active == True)
+    Only subscriptions this call actually deactivated get actions queued, so
+    the timers and the daily check never kick the same user twice. Users are
+    only kicked from channels they are recorded in (see channel_members.py).
+    """
+    channels = await config_cache.channels()
+    by_id = {sub.id: sub for sub in subs}
+    memberships = await queries.get_channel_memberships([sub.user.telegram_id for sub in subs])
+    actions = {
+        sub.id: _removal(sub, kick_channels(channels, sub.user.telegram_id, memberships))
+        for sub in subs
+    }
+    expired = await queries.deactivate_subscriptions(list(by_id), actions, fence=scheduler_lease.fence())
+    for sub_id in expired:
+        subscription_cache.invalidate(by_id[sub_id].user.telegram_id)
+    if expired:
+        outbox_dispatcher.wake()
+    return len(expired)
 
-    for sub in expired:
-        user = sub.user
-        sub.is_active = False
-        sub.save()
 
-        # Kick from all active channels
-        for ch in channels:
+# ─── Expiry timers ──────────────────────────────────────────────
+
+class ExpiryTimers:
+    """Heap of (due time, seq, kind, subscription id) drained by one background task.
+
+    Timers are never cancelled: when one fires the subscription is re-read and
+    skipped if it no longer needs that action. Timers falling due together are
+    handled as one batch; a batch that fails is retried after FIRE_RETRY_DELAY.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Highest subscription id loaded from the database, and when
+        self._loaded_id = 0
+        self._loaded_at = 0.0
+        # Ids above _loaded_id already added by schedule(), skipped when loaded
+        self._scheduled = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, when, kind: str, sub_id: int):
+        entry = (when, next(self._seq), kind, sub_id)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def _add(self, sub_id: int, end_date, warning_sent: bool):
+        if not warning_sent:
+            self._push(end_date - WARN_BEFORE, "warn", sub_id)
+        self._push(end_date, "expire", sub_id)
+
+    def schedule(self, sub):
+        """Add the warning and expiry timers of a new subscription.
+
+        Does nothing unless the timers run here; the instance running them
+        picks the subscription up from the database.
+        """
+        if self._task is not None and sub.id > self._loaded_id and sub.id not in self._scheduled:
+            self._scheduled.add(sub.id)
+            self._add(sub.id, sub.end_date, sub.warning_sent)
+
+    async def rebuild(self) -> int:
+        """Reload timers for every active subscription; returns subscriptions loaded."""
+        self._heap.clear()
+        self._loaded_id = 0
+        self._scheduled.clear()
+        loaded = await self._load_new()
+        self._wakeup.set()
+        return loaded
+
+    async def _load_new(self) -> int:
+        """Add timers for active subscriptions created since the last load."""
+        self._loaded_at = time.monotonic()
+        loaded = 0
+        while True:
+            rows = await queries.get_active_subscription_timers(self._loaded_id, SCHEDULER_CHUNK_SIZE)
+            if not rows:
+                break
+            self._loaded_id = rows[-1][0]
+            for sub_id, end_date, warning_sent in rows:
+                if sub_id in self._scheduled:
+                    self._scheduled.discard(sub_id)
+                    continue
+                self._add(sub_id, end_date, warning_sent)
+            loaded += len(rows)
+        # Scheduled here but no longer active when loaded
+        self._scheduled = {sub_id for sub_id in self._scheduled if sub_id > self._loaded_id}
+        return loaded
+
+    async def start(self):
+        # Never two loops draining one heap
+        await self.stop()
+        loaded = await self.rebuild()
+        self._task = asyncio.create_task(self._run(), name="expiry_timers")
+        logger.info(f"Expiry timers started for {loaded} active subscriptions")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if time.monotonic() - self._loaded_at >= NEW_SUBSCRIPTIONS_POLL:
+                try:
+                    await self._load_new()
+                except Exception as e:
+                    logger.error(f"Failed to load new subscription timers: {e}")
+
+            delay = NEW_SUBSCRIPTIONS_POLL
+            if self._heap:
+                delay = min(delay, (self._heap[0][0] - datetime.datetime.now()).total_seconds())
+            if delay > 0:
+                try:
+                    # Wall-clock jumps are picked up at the next poll
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = datetime.datetime.now()
+            due = {"warn": [], "expire": []}
+            for _ in range(SCHEDULER_CHUNK_SIZE):
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, kind, sub_id = heapq.heappop(self._heap)
+                due[kind].append(sub_id)
+
             try:
-                await context.bot.ban_chat_member(
-                    chat_id=ch.chat_id,
-                    user_id=user.telegram_id,
-                )
-                # Immediately unban so they can rejoin later after payment
-                await context.bot.unban_chat_member(
-                    chat_id=ch.chat_id,
-                    user_id=user.telegram_id,
-                )
-                logger.info(
-                    f"Removed user {user.telegram_id} from channel {ch.chat_id}"
-                )
+                await self._fire(due["warn"], due["expire"], now)
             except Exception as e:
-                logger.error(
-                    f"Failed to remove user {user.telegram_id} from {ch.chat_id}: {e}"
-                )
+                logger.error(f"Expiry timers failed for {due}, retrying: {e}")
+                retry_at = now + FIRE_RETRY_DELAY
+                for kind, sub_ids in due.items():
+                    for sub_id in sub_ids:
+                        self._push(retry_at, kind, sub_id)
 
-        # Notify user
-        try:
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=(
-                    "❌ <b>Obunangiz tugadi!</b>\n\n"
-                    "Siz guruh/kanallardan chiqarildingiz.\n\n"
-                    "Qayta obuna bo'lish uchun /start bosing."
-                ),
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify expired user {user.telegram_id}: {e}")
-
-    logger.info(
-        f"Subscription check done: {len(list(expiring))} warned, "
-        f"{len(list(expired))} expired"
-    )
+    @metrics.timed_job("expiry_timers")
+    async def _fire(self, warn_ids, expire_ids, now):
+        subs = {sub.id: sub for sub in await queries.get_subscriptions(warn_ids + expire_ids)}
+
+        warn = [
+            subs[i] for i in warn_ids
+            if i in subs and subs[i].is_active and not subs[i].warning_sent and subs[i].end_date > now
+        ]
+        expire = [
+            subs[i] for i in expire_ids
+            if i in subs and subs[i].is_active and subs[i].end_date <= now
+        ]
+
+        warned = await warn_subscriptions(warn, now) if warn else 0
+        expired = await expire_subscriptions(expire) if expire else 0
+        if warned or expired:
+            logger.info(f"Expiry timers: {warned} warned, {expired} expired")
+
+
+expiry_timers = ExpiryTimers()
+
+
+# ─── Daily check ────────────────────────────────────────────────
+
+@metrics.timed_job("subscription_check")
+async def check_subscriptions(context):
+    """Run daily: warn expiring users and kick expired ones the timers missed.
+
+    Subscriptions are streamed in id-ordered chunks with their users joined;
+    each chunk's flags and outbox actions are written in one transaction.
+    """
+    now = datetime.datetime.now()
+
+    warned = await _send_warnings(now)
+    expired = await _remove_expired(now)
+
+    logger.info(f"Subscription check done: {warned} warned, {expired} expired")
+
+
+async def _send_warnings(now) -> int:
+    """Warn users whose subscription ends within 3 days; returns users warned."""
+    warn_threshold = now + WARN_BEFORE
+
+    warned = 0
+    after_id = 0
+    while True:
+        chunk = await queries.get_expiring_subscriptions(now, warn_threshold, after_id, SCHEDULER_CHUNK_SIZE)
+        if not chunk:
+            break
+        after_id = chunk[-1].id
+        warned += await warn_subscriptions(chunk, now)
+
+    return warned
+
+
+async def _remove_expired(now) -> int:
+    """Deactivate expired subscriptions and queue their kicks; returns subscriptions expired."""
+    expired = 0
+    after_id = 0
+    while True:
+        chunk = await queries.get_expired_subscriptions(now, after_id, SCHEDULER_CHUNK_SIZE)
+        if not chunk:
+            break
+        after_id = chunk[-1].id
+        expired += await expire_subscriptions(chunk)
+
+    return expired
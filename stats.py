@@ -0,0 +1,150 @@
+"""Statistics — counters kept up to date alongside the rows they describe.
+
+Every write that changes a statistic calls `bump()` inside the same
+transaction, so the admin panel reads a handful of primary-key rows instead
+of counting whole tables. `reconcile_counters()` rebuilds the counters from
+the source tables, and `get_stats()` falls back to GROUP BY aggregates if
+the counters have never been built.
+
+Payment counters count the hot `payment` table, which the admin list pages
+through; payments moved to the archive (archive.py) are counted separately
+and added back in the totals.
+"""
+
+import logging
+
+from peewee import fn
+
+import metrics
+from database import db_task, write_transaction, StatCounter, User, Payment, Subscription, ArchivedPayment
+
+logger = logging.getLogger(__name__)
+
+USERS = "users"
+ACTIVE_SUBSCRIPTIONS = "active_subscriptions"
+PAYMENTS_PENDING = "payments_pending"
+PAYMENTS_APPROVED = "payments_approved"
+PAYMENTS_REJECTED = "payments_rejected"
+
+ARCHIVED_APPROVED = "archived_payments_approved"
+ARCHIVED_REJECTED = "archived_payments_rejected"
+
+PAYMENT_COUNTERS = {
+    "pending": PAYMENTS_PENDING,
+    "approved": PAYMENTS_APPROVED,
+    "rejected": PAYMENTS_REJECTED,
+}
+ARCHIVED_COUNTERS = {
+    "approved": ARCHIVED_APPROVED,
+    "rejected": ARCHIVED_REJECTED,
+}
+
+
+def bump(name: str, delta: int = 1):
+    """Add `delta` to a counter. Call inside the transaction of the change it counts."""
+    if delta:
+        (
+            StatCounter.insert(name=name, value=delta)
+            .on_conflict(
+                conflict_target=[StatCounter.name],
+                update={StatCounter.value: StatCounter.value + delta},
+            )
+            .execute()
+        )
+
+
+def move_payment(old_status, new_status):
+    """Count a payment leaving `old_status` and entering `new_status`."""
+    if old_status:
+        bump(PAYMENT_COUNTERS[old_status], -1)
+    if new_status:
+        bump(PAYMENT_COUNTERS[new_status], 1)
+
+
+def _aggregate_counts() -> dict:
+    """Compute every counter from the source tables."""
+    counts = {
+        USERS: User.select().count(),
+        ACTIVE_SUBSCRIPTIONS: Subscription.select().where(Subscription.is_active == True).count(),
+    }
+    counts.update(dict.fromkeys(PAYMENT_COUNTERS.values(), 0))
+    rows = Payment.select(Payment.status, fn.COUNT(Payment.id)).group_by(Payment.status).tuples()
+    for status, count in rows:
+        if status in PAYMENT_COUNTERS:
+            counts[PAYMENT_COUNTERS[status]] = count
+    counts.update(dict.fromkeys(ARCHIVED_COUNTERS.values(), 0))
+    # Absent while older migrations run
+    if ArchivedPayment.table_exists():
+        rows = (
+            ArchivedPayment.select(ArchivedPayment.status, fn.COUNT(ArchivedPayment.id))
+            .group_by(ArchivedPayment.status)
+            .tuples()
+        )
+        for status, count in rows:
+            if status in ARCHIVED_COUNTERS:
+                counts[ARCHIVED_COUNTERS[status]] = count
+    return counts
+
+
+def reconcile():
+    """Rebuild all counters from the source tables; returns {name: drift}."""
+    with write_transaction():
+        counts = _aggregate_counts()
+        current = {c.name: c.value for c in StatCounter.select()}
+        StatCounter.delete().execute()
+        StatCounter.insert_many(
+            [{"name": name, "value": value} for name, value in counts.items()]
+        ).execute()
+    return {
+        name: value - current.get(name, 0)
+        for name, value in counts.items()
+        if value != current.get(name, 0)
+    }
+
+
+@db_task
+def reconcile_counters():
+    return reconcile()
+
+
+def _read_counters() -> dict:
+    counts = {c.name: c.value for c in StatCounter.select()}
+    if not counts:
+        # Counters never built — serve from the aggregate path
+        counts = _aggregate_counts()
+    return counts
+
+
+@db_task
+def get_payment_count(status: str = None) -> int:
+    """Number of payments in the hot table (the admin list), optionally with `status`."""
+    counts = _read_counters()
+    if status:
+        return counts.get(PAYMENT_COUNTERS[status], 0)
+    return sum(counts.get(name, 0) for name in PAYMENT_COUNTERS.values())
+
+
+@db_task
+def get_stats() -> dict:
+    counts = _read_counters()
+    approved = counts.get(PAYMENTS_APPROVED, 0) + counts.get(ARCHIVED_APPROVED, 0)
+    rejected = counts.get(PAYMENTS_REJECTED, 0) + counts.get(ARCHIVED_REJECTED, 0)
+    pending = counts.get(PAYMENTS_PENDING, 0)
+    return {
+        "total_users": counts.get(USERS, 0),
+        "active_subs": counts.get(ACTIVE_SUBSCRIPTIONS, 0),
+        "total_payments": approved + rejected + pending,
+        "approved": approved,
+        "pending": pending,
+        "rejected": rejected,
+    }
+
+
+@metrics.timed_job("stats_reconcile")
+async def reconcile_job(context):
+    """Scheduled: rebuild the counters and log any drift that was corrected."""
+    drift = await reconcile_counters()
+    if drift:
+        logger.warning(f"Statistics counters reconciled, drift: {drift}")
+    else:
+        logger.info("Statistics counters reconciled, no drift")
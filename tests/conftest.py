@@ -0,0 +1,33 @@
+"""Shared fixtures: each test gets its own bot.db in a temporary directory."""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ["METRICS_PORT"] = "0"
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "bot.db")
+
+import pytest
+
+from database import db
+
+
+def use_database(path):
+    """Point the shared database at another SQLite file."""
+    db.close()
+    db.close_all()
+    db.init(str(path))
+
+
+@pytest.fixture
+def bot_db(tmp_path):
+    """A fresh bot.db, created and stamped by the migration runner."""
+    from migrations import run_migrations
+
+    use_database(tmp_path / "bot.db")
+    run_migrations()
+    yield db
+    db.close()
+    db.close_all()
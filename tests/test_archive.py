@@ -0,0 +1,52 @@
+"""Archiving must not let the hot tables reuse an archived id."""
+
+import asyncio
+import datetime
+
+import queries
+from archive import archive_old
+from database import ArchivedPayment, ArchivedSubscription, Payment, Subscription
+
+OLD = datetime.datetime.now() - datetime.timedelta(days=365)
+
+
+def _user():
+    return queries.save_user.sync(5, "Ali", "Valiyev", "+998901234567", None)
+
+
+def test_newest_payment_is_kept_and_ids_not_reused(bot_db):
+    user = _user()
+    first = queries.create_payment.sync(user, 99000, "receipt")
+    assert queries.reject_payment.sync(first)
+    Payment.update(created_at=OLD).execute()
+
+    assert asyncio.run(archive_old()) == (0, 0)
+    second = queries.create_payment.sync(user, 99000, "receipt")
+    assert second.id > first.id
+
+    queries.reject_payment.sync(second)
+    Payment.update(created_at=OLD).execute()
+    assert asyncio.run(archive_old()) == (0, 1)
+    assert ArchivedPayment.get_by_id(first.id)
+    assert queries.create_payment.sync(user, 99000, "receipt").id > second.id
+
+
+def test_newest_subscription_is_kept_and_ids_not_reused(bot_db):
+    user = _user()
+
+    def expired_subscription():
+        payment = queries.create_payment.sync(user, 99000, "receipt")
+        sub = queries.approve_payment.sync(payment, 1)
+        Subscription.update(is_active=False, end_date=OLD).where(Subscription.id == sub.id).execute()
+        return sub
+
+    first = expired_subscription()
+    assert asyncio.run(archive_old())[0] == 0
+    second = expired_subscription()
+    assert second.id > first.id
+
+    assert asyncio.run(archive_old())[0] == 1
+    assert ArchivedSubscription.get_by_id(first.id)
+    assert expired_subscription().id > second.id
+    # Nothing clashes on the next run
+    asyncio.run(archive_old())
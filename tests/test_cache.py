@@ -0,0 +1,82 @@
+"""Caches: invalidations are not undone by slower loads."""
+
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import cache
+import queries
+from cache import get_active_until, subscription_cache
+
+
+def test_invalidation_during_load_is_not_overwritten(monkeypatch):
+    loading = None
+    release = None
+
+    async def slow_status(telegram_id):
+        loading.set()
+        await release.wait()
+        return None  # read before the approval committed
+
+    async def main():
+        nonlocal loading, release
+        loading, release = asyncio.Event(), asyncio.Event()
+        subscription_cache.clear()
+
+        lookup = asyncio.create_task(get_active_until(1))
+        await loading.wait()
+        # The payment is approved while the lookup is still loading
+        subscription_cache.invalidate(1)
+        release.set()
+        assert await lookup is None
+        assert subscription_cache.get(1, "missing") == "missing"
+
+    monkeypatch.setattr(queries, "get_subscription_status", slow_status)
+    asyncio.run(main())
+
+
+def test_loaded_value_is_cached(monkeypatch):
+    end = datetime.datetime.now() + datetime.timedelta(days=30)
+
+    async def status(telegram_id):
+        return end
+
+    monkeypatch.setattr(queries, "get_subscription_status", status)
+    subscription_cache.clear()
+    assert asyncio.run(get_active_until(2)) == end
+    assert cache.is_active(subscription_cache.get(2))
+
+
+def test_negative_status_expires_sooner(monkeypatch):
+    async def status(telegram_id):
+        return None
+
+    monkeypatch.setattr(queries, "get_subscription_status", status)
+    monkeypatch.setattr(cache, "SUB_CACHE_NEGATIVE_TTL", -1)
+    subscription_cache.clear()
+    assert asyncio.run(get_active_until(3)) is None
+    # Approved on another instance: the next lookup goes back to the database
+    assert subscription_cache.get(3, "missing") == "missing"
+
+
+def test_config_invalidation_during_load_is_not_overwritten(monkeypatch):
+    calls = []
+
+    async def active_cards():
+        calls.append(None)
+        if len(calls) == 1:
+            # An admin adds a card while this load is in flight
+            config.invalidate_cards()
+            return []
+        return [SimpleNamespace(card_number="8600", card_holder="Ali")]
+
+    monkeypatch.setattr(queries, "get_active_cards", active_cards)
+    config = cache.ConfigCache(ttl=60)
+
+    async def main():
+        assert await config.card_text() == ""
+        assert "8600" in await config.card_text()
+        assert "8600" in await config.card_text()
+
+    asyncio.run(main())
+    assert len(calls) == 2
@@ -0,0 +1,87 @@
+"""EXPLAIN QUERY PLAN of the hot queries: each must be served by its index."""
+
+import datetime
+import sqlite3
+
+import pytest
+
+import queries
+from conftest import use_database
+from database import db
+from migrations import run_migrations
+
+# bot.db as created by the original create_tables(), before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE "user" ("id" INTEGER NOT NULL PRIMARY KEY, "telegram_id" INTEGER NOT NULL, "first_name" VARCHAR(255) NOT NULL, "last_name" VARCHAR(255) NOT NULL, "phone" VARCHAR(255) NOT NULL, "username" VARCHAR(255), "created_at" DATETIME NOT NULL);
+CREATE UNIQUE INDEX "user_telegram_id" ON "user" ("telegram_id");
+CREATE TABLE "card" ("id" INTEGER NOT NULL PRIMARY KEY, "card_number" VARCHAR(255) NOT NULL, "card_holder" VARCHAR(255) NOT NULL, "is_active" INTEGER NOT NULL, "created_at" DATETIME NOT NULL);
+CREATE TABLE "channel" ("id" INTEGER NOT NULL PRIMARY KEY, "chat_id" INTEGER NOT NULL, "title" VARCHAR(255) NOT NULL, "is_active" INTEGER NOT NULL, "created_at" DATETIME NOT NULL);
+CREATE TABLE "payment" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, "amount" INTEGER NOT NULL, "receipt_file_id" VARCHAR(255) NOT NULL, "status" VARCHAR(255) NOT NULL, "approved_by" INTEGER, "created_at" DATETIME NOT NULL, "approved_at" DATETIME, FOREIGN KEY ("user_id") REFERENCES "user" ("id"));
+CREATE INDEX "payment_user_id" ON "payment" ("user_id");
+CREATE TABLE "subscription" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, "payment_id" INTEGER NOT NULL, "start_date" DATETIME NOT NULL, "end_date" DATETIME NOT NULL, "is_active" INTEGER NOT NULL, "warning_sent" INTEGER NOT NULL, FOREIGN KEY ("user_id") REFERENCES "user" ("id"), FOREIGN KEY ("payment_id") REFERENCES "payment" ("id"));
+CREATE INDEX "subscription_user_id" ON "subscription" ("user_id");
+CREATE INDEX "subscription_payment_id" ON "subscription" ("payment_id");
+"""
+
+NOW = datetime.datetime(2026, 1, 1)
+
+# (query, index its first SELECT must use)
+HOT_QUERIES = [
+    (
+        lambda: queries.get_expiring_subscriptions.sync(NOW, NOW + datetime.timedelta(days=3), 0, 100),
+        "subscription_is_active_warning_sent_end_date",
+    ),
+    (lambda: queries.get_expired_subscriptions.sync(NOW, 0, 100), "subscription_is_active_end_date"),
+    (lambda: queries.get_subscription_status.sync(12345), "subscription_user_id_is_active"),
+    (lambda: queries.get_payments_page.sync("pending", "start", None, 10), "payment_status_created_at"),
+    (lambda: queries.get_payments_page.sync("approved", "next", (NOW, 50), 10), "payment_status_created_at"),
+    (lambda: queries.get_payments_page.sync("rejected", "prev", (NOW, 50), 10), "payment_status_created_at"),
+    # Default admin list, no status filter
+    (lambda: queries.get_payments_page.sync(None, "start", None, 10), "payment_created_at"),
+    (lambda: queries.get_payments_page.sync(None, "next", (NOW, 50), 10), "payment_created_at"),
+    (lambda: queries.get_payments_page.sync(None, "prev", (NOW, 50), 10), "payment_created_at"),
+]
+
+
+def _query_plan(run) -> str:
+    """Run a query function and return the plan of the SQL it executed."""
+    executed = []
+    execute_sql = db.execute_sql
+
+    def record(sql, params=None, *args, **kwargs):
+        executed.append((sql, params))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = record
+    try:
+        with db.connection_context():
+            run()
+    finally:
+        del db.execute_sql
+    sql, params = executed[0]
+    with db.connection_context():
+        rows = db.execute_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A pre-migration bot.db, upgraded by the migration runner."""
+    path = tmp_path / "bot.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    use_database(path)
+    run_migrations()
+    yield db
+    db.close_all()
+
+
+@pytest.mark.parametrize("run, index", HOT_QUERIES)
+def test_fresh_database_uses_index(bot_db, run, index):
+    assert f"USING INDEX {index}" in _query_plan(run)
+
+
+@pytest.mark.parametrize("run, index", HOT_QUERIES)
+def test_migrated_database_uses_index(baseline_db, run, index):
+    assert f"USING INDEX {index}" in _query_plan(run)
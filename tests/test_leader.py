@@ -0,0 +1,99 @@
+"""Leader lease: several in-process instances sharing one SQLite file."""
+
+import asyncio
+import time
+
+import leader
+from database import Lease, write_transaction
+from leader import LeaderLease, LeaseLost
+
+
+def _fence_holds(fence) -> bool:
+    try:
+        with write_transaction():
+            leader.check_fence(fence)
+    except LeaseLost:
+        return False
+    return True
+
+
+def test_one_leader_and_failover(bot_db):
+    async def main():
+        instances = [LeaderLease("s", ttl=1, heartbeat=0.2) for _ in range(4)]
+        for instance in instances:
+            await instance.start()
+        await asyncio.sleep(0.5)
+        leaders = [instance for instance in instances if instance.is_leader]
+        assert len(leaders) == 1
+        old = leaders[0]
+        old_fence = old.fence()
+        assert _fence_holds(old_fence)
+
+        # The holder dies without releasing its lease
+        old._task.cancel()
+        await asyncio.gather(old._task, return_exceptions=True)
+        await asyncio.sleep(1.6)
+
+        leaders = [instance for instance in instances if instance.is_leader]
+        assert len(leaders) == 1 and leaders[0] is not old
+        assert not old.may_run
+        assert leaders[0].token == old_fence[2] + 1
+        assert not _fence_holds(old_fence)
+        assert _fence_holds(leaders[0].fence())
+
+        for instance in instances:
+            if instance is not old:
+                await instance.stop()
+
+    asyncio.run(main())
+
+
+def test_takeover_from_stale_read_changes_nothing(bot_db, monkeypatch):
+    assert leader._acquire.sync("s", "a", 0.01) == 1
+    time.sleep(0.02)
+    stale = Lease.get_by_id("s")
+    assert leader._acquire.sync("s", "b", 30) == 2
+
+    # "c" read the expired lease before "b" took it over
+    monkeypatch.setattr(Lease, "get_or_none", lambda *args: stale)
+    assert leader._acquire.sync("s", "c", 30) is None
+    monkeypatch.undo()
+
+    lease = Lease.get_by_id("s")
+    assert (lease.holder, lease.token) == ("b", 2)
+
+
+def test_fence_of_other_holder_is_refused(bot_db):
+    assert leader._acquire.sync("s", "a", 30) == 1
+    assert _fence_holds(("s", "a", 1))
+    assert not _fence_holds(("s", "b", 1))
+    assert not _fence_holds(("s", "a", 2))
+
+
+
+def test_retaken_lease_ends_the_old_term_first(monkeypatch):
+    tokens = iter([1, 2])
+    events = []
+
+    async def acquire(name, holder, ttl):
+        return next(tokens)
+
+    async def on_elected():
+        events.append("elected")
+
+    async def on_demoted():
+        events.append("demoted")
+
+    async def main():
+        lease = LeaderLease("s", ttl=30, heartbeat=30)
+        lease._on_elected, lease._on_demoted = on_elected, on_demoted
+        await lease._beat()
+        await asyncio.sleep(0)
+        # A stalled holder takes the lease back after another one released it
+        await lease._beat()
+        await asyncio.sleep(0)
+        assert lease.token == 2
+
+    monkeypatch.setattr(leader, "_acquire", acquire)
+    asyncio.run(main())
+    assert events == ["elected", "demoted", "elected"]
@@ -0,0 +1,57 @@
+"""Concurrent admin decisions on one payment: exactly one may win."""
+
+import asyncio
+
+import outbox
+import queries
+import stats
+from database import Outbox, Payment, Subscription
+
+APPROVALS = 200
+
+
+def _pending_payment():
+    user = queries.save_user.sync(5, "Ali", "Valiyev", "+998901234567", None)
+    return queries.create_payment.sync(user, 99000, "receipt")
+
+
+def test_concurrent_approvals_have_one_winner(bot_db):
+    payment = _pending_payment()
+
+    async def approve(admin_id):
+        # Every admin's handler works on its own copy of the row
+        own_copy = await queries.get_payment(payment.id)
+        action = outbox.Action(outbox.INVITE, 5, {}, f"invite:{payment.id}:{admin_id}")
+        return await queries.approve_payment(own_copy, admin_id, actions=[action])
+
+    async def main():
+        return await asyncio.gather(*(approve(admin_id) for admin_id in range(APPROVALS)))
+
+    results = asyncio.run(main())
+
+    winners = [sub for sub in results if sub is not None]
+    assert len(winners) == 1
+    assert Subscription.select().where(Subscription.payment == payment.id).count() == 1
+    assert Payment.get_by_id(payment.id).approved_by == winners[0].payment.approved_by
+    assert Outbox.select().count() == 1
+    assert stats.reconcile() == {}
+
+
+def test_concurrent_approve_and_reject_have_one_winner(bot_db):
+    payment = _pending_payment()
+
+    async def decide(i):
+        own_copy = await queries.get_payment(payment.id)
+        if i % 2:
+            return await queries.reject_payment(own_copy)
+        return await queries.approve_payment(own_copy, i)
+
+    async def main():
+        return await asyncio.gather(*(decide(i) for i in range(APPROVALS)))
+
+    results = asyncio.run(main())
+
+    assert sum(1 for result in results if result) == 1
+    status = Payment.get_by_id(payment.id).status
+    assert Subscription.select().count() == (1 if status == "approved" else 0)
+    assert stats.reconcile() == {}
@@ -0,0 +1,65 @@
+"""Writes of SQLitePersistence: nothing queued may be left behind."""
+
+import asyncio
+
+import queries
+from persistence import SQLitePersistence, _digest
+
+
+def _recording_save(monkeypatch, delay: float, failures: int = 0):
+    """Replace save_persistence with a slow one; returns the list of saved batches."""
+    saved = []
+
+    async def save_persistence(users, conversations):
+        await asyncio.sleep(delay)
+        if len(saved) < failures:
+            saved.append(None)
+            raise RuntimeError("database is locked")
+        saved.append((dict(users), dict(conversations)))
+
+    monkeypatch.setattr(queries, "save_persistence", save_persistence)
+    return saved
+
+
+def test_change_during_write_is_written(monkeypatch):
+    saved = _recording_save(monkeypatch, delay=0.05)
+
+    async def main():
+        persistence = SQLitePersistence(update_interval=60)
+        await persistence.update_conversation("registration", (1, 1), 1)
+        await asyncio.sleep(0.01)  # first write in flight
+        await persistence.update_conversation("registration", (1, 1), 2)
+        await asyncio.sleep(0.2)
+        return persistence
+
+    persistence = asyncio.run(main())
+    assert [batch[1] for batch in saved] == [{("registration", "[1, 1]"): "1"}, {("registration", "[1, 1]"): "2"}]
+    assert not persistence._pending_conversations
+
+
+def test_failed_write_is_retried(monkeypatch):
+    saved = _recording_save(monkeypatch, delay=0, failures=2)
+
+    async def main():
+        persistence = SQLitePersistence(update_interval=0.05)
+        await persistence.update_user_data(7, {"lang": "uz"})
+        await asyncio.sleep(0.3)
+        return persistence
+
+    persistence = asyncio.run(main())
+    assert saved[-1] == ({7: '{"lang": "uz"}'}, {})
+    assert persistence._saved[7] == _digest('{"lang": "uz"}')
+    assert not persistence._pending_users
+
+
+def test_flush_does_not_wait_for_retry_delay(monkeypatch):
+    saved = _recording_save(monkeypatch, delay=0, failures=1)
+
+    async def main():
+        persistence = SQLitePersistence(update_interval=3600)
+        await persistence.update_user_data(7, {"lang": "uz"})
+        await asyncio.sleep(0.05)  # first attempt failed, waiting to retry
+        await asyncio.wait_for(persistence.flush(), timeout=1)
+
+    asyncio.run(main())
+    assert saved[-1] == ({7: '{"lang": "uz"}'}, {})
@@ -0,0 +1,93 @@
+"""PerUserUpdateProcessor: users run in parallel, each key keeps its order."""
+
+import asyncio
+
+from telegram import Update
+
+from benchmarks.fake_bot_api import callback_update, text_update
+from update_processor import PerUserUpdateProcessor
+
+USER_A = 1001
+USER_B = 1002
+ADMIN_1 = 2001
+ADMIN_2 = 2002
+
+
+def _update(data: dict) -> Update:
+    return Update.de_json(data, None)
+
+
+async def _handle(log: list, name: str, seconds: float):
+    log.append(("start", name))
+    await asyncio.sleep(seconds)
+    log.append(("end", name))
+
+
+async def _process(processor, updates):
+    """Feed the updates in the given order, as the Application would, and wait for all."""
+    tasks = []
+    for update, coroutine in updates:
+        tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+        # Let each update reach its key before the next one arrives
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+
+def test_slow_user_does_not_delay_others():
+    async def main():
+        processor = PerUserUpdateProcessor(workers=4, max_pending=16)
+        log = []
+        done = {}
+
+        async def timed(name, seconds):
+            await _handle(log, name, seconds)
+            done[name] = asyncio.get_running_loop().time()
+
+        start = asyncio.get_running_loop().time()
+        await _process(
+            processor,
+            [
+                (_update(text_update(1, USER_A, "a")), timed("a", 0.5)),
+                (_update(text_update(2, USER_B, "b")), timed("b", 0.01)),
+            ],
+        )
+        assert done["b"] - start < 0.25
+        assert done["a"] - start >= 0.5
+
+    asyncio.run(main())
+
+
+def test_same_user_keeps_order():
+    async def main():
+        processor = PerUserUpdateProcessor(workers=4, max_pending=16)
+        log = []
+        # Earlier updates are slower, so any overlap would reorder the log
+        await _process(
+            processor,
+            [
+                (_update(text_update(i, USER_A, str(i))), _handle(log, f"a{i}", 0.05 * (5 - i)))
+                for i in range(5)
+            ],
+        )
+        expected = []
+        for i in range(5):
+            expected += [("start", f"a{i}"), ("end", f"a{i}")]
+        assert log == expected
+
+    asyncio.run(main())
+
+
+def test_same_payment_keeps_order_across_admins():
+    async def main():
+        processor = PerUserUpdateProcessor(workers=4, max_pending=16)
+        log = []
+        await _process(
+            processor,
+            [
+                (_update(callback_update(1, ADMIN_1, "approve_7")), _handle(log, "approve", 0.1)),
+                (_update(callback_update(2, ADMIN_2, "reject_7")), _handle(log, "reject", 0.01)),
+            ],
+        )
+        assert log == [("start", "approve"), ("end", "approve"), ("start", "reject"), ("end", "reject")]
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Concurrent update processing that keeps each user's updates in order."""
+
+import asyncio
+import re
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from profiler import profiler
+
+_PAYMENT_DECISION = re.compile(r"^(approve|reject)_(\d+)$")
+
+
+def update_key(update):
+    """Ordering key of an update: updates with the same key never run concurrently.
+
+    Payment decisions are keyed by payment, so two admins pressing the buttons of
+    the same receipt are handled one after the other; everything else is keyed
+    by user (falling back to chat), which keeps ConversationHandler flows intact.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.callback_query and update.callback_query.data:
+        match = _PAYMENT_DECISION.match(update.callback_query.data)
+        if match:
+            return ("payment", int(match.group(2)))
+    if update.effective_user:
+        return ("user", update.effective_user.id)
+    if update.effective_chat:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `workers` updates at once, serialising updates that share a key.
+
+    PTB holds its own semaphore while an update waits for its key, so that bound
+    (`max_pending`) is set well above `workers`: one busy user queueing many
+    updates cannot take the slots other users need.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        super().__init__(max_concurrent_updates=max(max_pending, workers))
+        self._workers = asyncio.BoundedSemaphore(workers)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            async with self._workers:
+                await self._run(coroutine)
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @staticmethod
+    async def _run(coroutine):
+        # Count the DB calls this update makes, and the update for /profile
+        token = metrics.begin_update()
+        try:
+            await coroutine
+        finally:
+            metrics.end_update(token)
+            if profiler.session is not None:
+                profiler.update_done()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass